@@ -7,26 +7,59 @@
 #Author: Gerth Jaanimäe
 from __future__ import unicode_literals, print_function, absolute_import
 import sys
-if len(sys.argv) < 3:
-	sys.stderr.write("Error: You must specify the input corpus and output directory for automatic annotations. Optionally you can also add the directory for user dictionaries.\nUsage: annotate_corpus.py <input_corpus> <output_directory_for_annotated-files> <optional-user_dictionaries>\n")
-	sys.exit(1)
+import argparse
+arg_parser=argparse.ArgumentParser(description="Performs the morphological analysis of municipal court records and saves the results as .tsv files.")
+arg_parser.add_argument("input_corpus", help="the corpus as a csv file or as a directory of xml files")
+arg_parser.add_argument("output_directory", help="the directory for the annotated files")
+arg_parser.add_argument("user_dictionaries", nargs="?", default="", help="the directory for the user dictionaries")
+arg_parser.add_argument("--workers", type=int, default=1, help="the number of processes annotating the records (default: 1)")
+arg_parser.add_argument("--corpus-cache", default=None, help="the file for caching the cleaned records of the corpus between the runs")
+arg_parser.add_argument("--incremental", action="store_true", help="skip the records whose output is up to date according to the manifest in the output directory")
+arg_parser.add_argument("--read-threads", type=int, default=None, help="read the xml files in this many threads and parse them in parallel, in the order of their paths")
+arg_parser.add_argument("--output-format", choices=["tsv", "parquet", "arrow"], default="tsv", help="write a tsv file for each record (default) or one columnar file (Parquet or Arrow IPC) for each location, which needs pyarrow")
+arg_parser.add_argument("--max-word-types", type=int, default=None, help="count at most this many word forms per location for the frequency lists, the counts of the rarest ones are then approximate")
+arg_parser.add_argument("--max-loaded-dicts", type=int, default=None, help="keep at most this many location dictionaries loaded in each process, the least recently used one is dropped")
+arg_parser.add_argument("--stats-json", default=None, help="save the statistics as a json report into this file, the reports can be merged with merge_stats.py")
+arg_parser.add_argument("--stats-csv", default=None, help="save the statistics as csv files into this directory")
+arg_parser.add_argument("--decade-range", default="1820-1920", help="the first and the last decade of the table of decades in the output (default: 1820-1920)")
+arg_parser.add_argument("--unknown-words", default="tundmatud_sonad.txt", help="the file for the most frequent unknown words (default: tundmatud_sonad.txt)")
+arg_parser.add_argument("--analysis-cache-size", type=int, default=100000, help="the number of word forms whose analyses are cached in each process, 0 switches the cache off (default: 100000)")
+args=arg_parser.parse_args()
+if args.analysis_cache_size < 0:
+	arg_parser.error("--analysis-cache-size must not be negative")
+if args.incremental and args.output_format != "tsv":
+	arg_parser.error("--incremental can only be used with the tsv output")
+try:
+	first_decade, last_decade=[int(decade) for decade in args.decade_range.split("-")]
+except ValueError:
+	arg_parser.error("--decade-range must be given as FIRST-LAST, e.g. 1820-1920")
 
 
 from estnltk.text import Text
 from collections import defaultdict
-import csv
 import os, os.path
+import multiprocessing
+import json
+import hashlib
+import time
+import estnltk
 import corpus_readers
+from corpus_stats import CorpusStats, write_json_report, write_csv_report
+from corpus_writers import write_analysis_tsv, analysis_columns, ColumnarSink
 from morph_pipeline import *
 from estnltk.taggers.morph_analysis.morf_common import _is_empty_annotation
 # If the missing punctuation analysis should be added to the tsv output
 add_punctuation_analyses = True
 add_sentence_boundaries=True
+# If the words that remain unanalysed should be normalized by the rules of the rule_based_normalizer
+rule_based_normalization = False
 #If the punctuation analyses should be subtracted from the statistics
 subtract_punctuation_analyses = True
 
 # If the headers should be added to the tsv files
 add_tsv_headers = False
+# How many word forms the analysis cache keeps. If None, the word forms are analysed without caching.
+analysis_cache_size = args.analysis_cache_size if args.analysis_cache_size > 0 else None
 #Finds how many percents C constitutes from A and formats the results as string
 def get_percentage_of_all_str( c, a ):
 	return '{} / {} ({:.2f}%)'.format(c, a, (c*100.0)/a)
@@ -42,73 +75,7 @@ def write_analysis_tsv_file( text, out_file_name ):
 		
 		sentence_boundaries = find_sentence_boundaries_alt(text)
 		assert len(sentence_boundaries) > 0
-	with open(out_file_name, 'w', encoding='utf-8', newline='\n') as csvfile:
-		fieldnames = ['word', 'root', 'ending', 'clitic', 'partofspeech', 'form']
-		writer = csv.DictWriter(csvfile, delimiter='\t', fieldnames=fieldnames)
-		if add_tsv_headers:
-			writer.writeheader() # Write the headers at the beginning
-		sentence_id = 0
-		word_count  = 0
-		
-		for word in text.morph_analysis:
-			analyses=word.annotations
-			# Beginning of sentence
-			if add_sentence_boundaries and sentence_boundaries != None and len(sentence_boundaries) > 0:
-				sentence_span = sentence_boundaries[sentence_id]
-				# Beginning of sentence
-				if word.start == sentence_span[0]:
-					analysis_item = {}
-					analysis_item['word']='<s>'
-					analysis_item['root']=''
-					analysis_item['ending']=''
-					analysis_item['clitic']=''
-					analysis_item['partofspeech']=''
-					analysis_item['form']=''
-					writer.writerow(analysis_item)
-			# Output the word analyses, if they exist
-			if not _is_empty_annotation(analyses[0]):
-				for aid, analysis in enumerate(analyses):
-					analysis_item = {}
-					analysis_item['word']=word.text
-					analysis_item['root']=analysis['root']
-					analysis_item['ending']=analysis['ending']
-					analysis_item['clitic']=analysis['clitic']
-					analysis_item['partofspeech']=analysis['partofspeech']
-					analysis_item['form']=analysis['form']
-					if aid > 0:
-						analysis_item['word']=' '*len(word.text)
-					writer.writerow(analysis_item)
-			# If there are no analyses, output the empty line
-			if _is_empty_annotation(analyses[0]):
-				analysis_item = {}
-				analysis_item['word']=word.text
-				analysis_item['root']='####'
-				analysis_item['ending']=''
-				analysis_item['clitic']=''
-				analysis_item['partofspeech']=''
-				analysis_item['form']=''
-				writer.writerow(analysis_item)
-			# End of sentence
-			if add_sentence_boundaries and sentence_boundaries != None and len(sentence_boundaries) > 0:
-				sentence_span = sentence_boundaries[sentence_id]
-				if word.end == sentence_span[1]:
-					analysis_item = {}
-					analysis_item['word']='</s>'
-					analysis_item['root']=''
-					analysis_item['ending']=''
-					analysis_item['clitic']=''
-					analysis_item['partofspeech']=''
-					analysis_item['form']=''
-					writer.writerow(analysis_item)
-					sentence_id += 1
-		if add_sentence_boundaries and sentence_boundaries != None and len(sentence_boundaries) > 0:
-			#if sentence_id != len(sentence_boundaries):
-	#			print ("Midagi läks lausepiiride panemisel viltu failis ", out_file_name, "; pandi ", sentence_id, " lausepiiri. Tegelikult oli ", len(sentence_boundaries), "lausepiiri.")
-			assert sentence_id == len(sentence_boundaries), \
-			  '(!) Midagi l2ks lausepiiride panemisel viltu failis '+\
-			   str(out_file_name)+'; Pandi '+str(sentence_id)+' lausepiiri / '+\
-			   'tegelikult oli '+str(len(sentence_boundaries))+' lausepiiri;'
-
+	write_analysis_tsv( text, out_file_name, sentence_boundaries, add_tsv_headers )
 
 
 # Finds the sentence boundaries of input text
@@ -145,98 +112,253 @@ def find_sentence_boundaries_alt(text):
 	for sentence in text['sentences']:
 		results.append((sentence.start, sentence.end))
 	return results
-infile=sys.argv[1]
-outputdir=sys.argv[2]
+infile=args.input_corpus
+outputdir=args.output_directory
+output_format=args.output_format
 if not os.path.exists(outputdir):
 	os.mkdir(outputdir)
-if len(sys.argv) > 3:
-	user_dict_dir=sys.argv[3]
-else:
-	user_dict_dir=""
+user_dict_dir=args.user_dictionaries
+#The index of the user dictionaries is built once here, the pipelines (also the ones of the workers) only open it
+user_dict_index_file=build_user_dict_index(user_dict_dir)
 
 
-#	 (records, analysed, unamb, unk_title, unk_punct, punct, total)
-def process_location():
-	#Setup the configuration for the morphological analysis
-	
-	morph_conf={'vm_analyzer' : VabamorfAnalyzer(guess=False, propername=False),
+#Setup the pipeline for the morphological analysis
+def create_morph_pipeline():
+	if analysis_cache_size is not None:
+		vm_analyzer = CachedVabamorfAnalyzer(analysis_cache=AnalysisCache(analysis_cache_size), guess=False, propername=False)
+	else:
+		vm_analyzer = VabamorfAnalyzer(guess=False, propername=False)
+	return MorphPipeline({'vm_analyzer' : vm_analyzer,
 		'newline_sentence_tokenizer' : SentenceTokenizer( base_sentence_tokenizer=LineTokenizer() ),
 		'tokens_tagger' : TokensTagger(),
 		'prenormalizer' : word_prenormalizer(),
+		'normalize' : rule_based_normalization,
 		'add_punctuation_analyses' : add_punctuation_analyses,
-		'user_dictionaries' : create_user_dict_taggers(user_dict_dir)}
-	records=defaultdict(int)
-	analysed=defaultdict(int)
-	unamb=defaultdict(int)
-	total=defaultdict(int)
-	unk_title=defaultdict(int)
-	unk_punct=defaultdict(int)
-	punct=defaultdict(int)
-	decades_analysed=defaultdict(lambda: defaultdict(int))
-	decades_total=defaultdict(lambda: defaultdict(int))
-	freq_analysed=defaultdict(lambda: defaultdict(int))
-	freq_not_analysed=defaultdict(lambda: defaultdict(int))
-	texts=corpus_readers.read_corpus(infile)
-	for text in texts:
-		location=text.meta['location']
-		records[location]+=1
-		#Change the year into decade
-		decade=text.meta['year'][:-1]+"0"
-		text=apply_pipeline(text, morph_conf)
-		# Collect the statistics
-		for word in text.morph_analysis:
-			is_punct = len(word.text) > 0 and not any([c.isalnum() for c in word.text])
-			if not _is_empty_annotation( word.annotations[0] ):
-				analysed[location] += 1
-				decades_analysed[location][decade]+=1
-				if not is_punct:
-					freq_analysed[location][word.text]+=1
-				if len(word.annotations) == 1:
-					unamb[location] += 1
-			if _is_empty_annotation( word.annotations[0] ):
-				freq_not_analysed[location][word.text]+=1
-				# save the type of unknown word
-				
-				if len(word.text) > 0:
-					if word.text[0].isupper():
-						unk_title[location] += 1
-					if is_punct:
-						unk_punct[location] += 1
-			else:
-				# Save the type of regular word
-				if is_punct:
-					punct[location] += 1
-			total[location] += 1
-			decades_total[location][decade]+=1
+		'user_dictionaries' : open_user_dict_index(user_dict_index_file, max_locations=args.max_loaded_dicts)})
+
+#Writes the analyses of the text into tsv file and adds the counts to the statistics
+#The seconds spent in collecting the statistics and in the output are added to timings.
+def annotate_text(text, stats, timings):
+	location=text.meta['location']
+	start=time.perf_counter()
+	# Collect the statistics
+	stats.add_text(text)
+	end=time.perf_counter()
+	timings['statistics']=timings.get('statistics', 0.0)+end-start
+	# The columnar output is written by the main process
+	if output_format != 'tsv':
+		columns=analysis_columns( text )
+	else:
 		# Write the morph analyses into tsv files
-		if not os.path.exists(os.path.join(outputdir, text.meta['location'])):
-			os.mkdir(os.path.join(outputdir, text.meta['location']))
-		out_file_name = os.path.join(outputdir, text.meta['location'], str(text.meta['id'])+'.tsv')
+		os.makedirs(os.path.join(outputdir, location), exist_ok=True)
+		out_file_name = os.path.join(outputdir, location, str(text.meta['id'])+'.tsv')
 		write_analysis_tsv_file( text, out_file_name )
+		columns=None
+	timings['output']=timings.get('output', 0.0)+time.perf_counter()-end
+	return columns
+
+#The pipeline of a worker process, it is created once per process
+worker_morph_pipeline=None
+
+def init_worker():
+	global worker_morph_pipeline
+	worker_morph_pipeline=create_morph_pipeline()
+
+#Annotates a batch of records, except the ones whose output is up to date.
+#A record is a tuple of (content, meta, record_hash, stored_stats), where stored_stats are the statistics of an earlier run.
+#The texts of the batch are analysed together, so that Vabamorf is called once for their word forms.
+#Returns for each record the meta, the record_hash, the statistics of the record and whether it was annotated.
+#In a worker process only these are sent back, the analyses are written by the worker.
+def annotate_records(records, morph_pipeline=None):
+	if morph_pipeline is None:
+		morph_pipeline=worker_morph_pipeline
+	texts=[]
+	for (content, meta, record_hash, stored_stats) in records:
+		if stored_stats is None:
+			text=Text(content)
+			text.meta=meta
+			texts.append(text)
+	analysed_texts=morph_pipeline.process_many(texts)
+	results=[]
+	timings={}
+	for (content, meta, record_hash, stored_stats) in records:
+		if stored_stats is not None:
+			results.append((meta, record_hash, stored_stats, False, None))
+			continue
+		record_stats=CorpusStats()
+		columns=annotate_text(next(analysed_texts), record_stats, timings)
+		results.append((meta, record_hash, record_stats.to_plain(), True, columns))
+	timings.update(morph_pipeline.pop_timings())
+	return results, timings
+
+#Groups the records into batches
+def batch_records(records, batch_size=50):
+	batch=[]
+	for record in records:
+		batch.append(record)
+		if len(batch) == batch_size:
+			yield batch
+			batch=[]
+	if batch:
+		yield batch
+
+class Manifest:
+    """The manifest of the annotated records in the output directory.
+       For each record it stores the hash of the input, the fingerprint of the configuration, the user dictionaries,
+       the code of the analysis and the EstNLTK version, and the statistics of the record. The entries are appended
+       as soon as the records are annotated, so that an interrupted run can be resumed."""
+    file_name = 'manifest.jsonl'
+    version = '1'
+    #The modules whose code makes the output and the statistics, a change in any of them (or in this script)
+    #means that the records are annotated again
+    code_modules = ['morph_pipeline', 'corpus_writers', 'corpus_stats']
+    
+    def __init__(self, outputdir, user_dict_dir):
+        self.outputdir = outputdir
+        self.user_dict_dir = user_dict_dir
+        self.path = os.path.join(outputdir, self.file_name)
+        self._fingerprints = {}
+        self.code_hash = self._code_hash()
+        self._entries = {}
+        self._current_entries = []
+        if os.path.exists(self.path):
+            with open(self.path, encoding='utf-8') as fin:
+                for line in fin:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # The last line may be incomplete, if the run was interrupted
+                        continue
+                    self._entries[(entry['location'], entry['id'])] = entry
+        self._fout = open(self.path, 'a', encoding='utf-8')
+    
+    def _code_hash(self):
+        code_hash = hashlib.sha256()
+        for code_file in [__file__]+[sys.modules[name].__file__ for name in self.code_modules]:
+            with open(code_file, 'rb') as fin:
+                code_hash.update(hashlib.sha256(fin.read()).digest())
+        return code_hash.hexdigest()
+    
+    def _dictionary_hash(self, name):
+        dict_file = os.path.join(self.user_dict_dir, name+'.tsv')
+        if self.user_dict_dir == '' or not os.path.isfile(dict_file):
+            return ''
+        with open(dict_file, 'rb') as fin:
+            return hashlib.sha256(fin.read()).hexdigest()
+    
+    def fingerprint(self, location):
+        """The fingerprint of the settings, the user dictionaries and the code that are applied to the records of the location."""
+        if location not in self._fingerprints:
+            settings = [self.version, getattr(estnltk, '__version__', ''), self.code_hash, add_punctuation_analyses, add_sentence_boundaries, add_tsv_headers, rule_based_normalization,
+                        self._dictionary_hash('global'), self._dictionary_hash(location)]
+            self._fingerprints[location] = hashlib.sha256(json.dumps(settings).encode('utf-8')).hexdigest()
+        return self._fingerprints[location]
+    
+    @staticmethod
+    def record_hash(content, meta):
+        return hashlib.sha256(json.dumps([content, meta], ensure_ascii=False, sort_keys=True).encode('utf-8')).hexdigest()
+    
+    def stored_statistics(self, meta, record_hash):
+        """Returns the statistics of the record, if its output is up to date. Otherwise returns None."""
+        entry = self._entries.get((meta['location'], str(meta['id'])))
+        if entry is None or entry['hash'] != record_hash or entry['config'] != self.fingerprint(meta['location']):
+            return None
+        if not os.path.exists(os.path.join(self.outputdir, meta['location'], str(meta['id'])+'.tsv')):
+            return None
+        return entry['stats']
+    
+    def add(self, meta, record_hash, record_stats, annotated):
+        entry = {'location': meta['location'], 'id': str(meta['id']), 'hash': record_hash,
+                 'config': self.fingerprint(meta['location']), 'stats': record_stats}
+        self._current_entries.append(entry)
+        if annotated:
+            self._fout.write(json.dumps(entry, ensure_ascii=False)+'\n')
+            self._fout.flush()
+    
+    def close(self):
+        """Rewrites the manifest with the entries of the records of this run."""
+        self._fout.close()
+        with open(self.path+'.tmp', 'w', encoding='utf-8') as fout:
+            for entry in self._current_entries:
+                fout.write(json.dumps(entry, ensure_ascii=False)+'\n')
+        os.replace(self.path+'.tmp', self.path)
+
+#Pairs the texts with the information needed for skipping the records that are up to date
+def plan_records(texts, manifest):
+	for text in texts:
+		record_hash=None
+		stored_stats=None
+		if manifest is not None:
+			record_hash=Manifest.record_hash(text.text, text.meta)
+			stored_stats=manifest.stored_statistics(text.meta, record_hash)
+		yield (text.text, text.meta, record_hash, stored_stats)
+
+#	 (records, analysed, unamb, unk_title, unk_punct, punct, total)
+def process_location(workers=1, incremental=False):
+	start=time.perf_counter()
+	stats=CorpusStats(args.max_word_types)
+	manifest=Manifest(outputdir, user_dict_dir) if incremental else None
+	sink=ColumnarSink(outputdir, output_format) if output_format != 'tsv' else None
+	texts=corpus_readers.read_corpus(infile, args.read_threads, cache_path=args.corpus_cache)
+	records_to_process=plan_records(texts, manifest)
+	skipped=0
+	if workers > 1:
+		# The workers are forked, so that they get the settings of this script without running it again
+		pool=multiprocessing.get_context('fork').Pool(workers, initializer=init_worker)
+		batches=pool.imap(annotate_records, batch_records(records_to_process))
+	else:
+		morph_pipeline=create_morph_pipeline()
+		batches=(annotate_records(batch, morph_pipeline) for batch in batch_records(records_to_process))
+	for (batch_results, batch_timings) in batches:
+		stats.add_timings(batch_timings)
+		for (meta, record_hash, record_stats, annotated, columns) in batch_results:
+			stats.merge(CorpusStats.from_plain(record_stats))
+			if sink is not None:
+				sink.add(meta['location'], columns)
+			if manifest is not None:
+				manifest.add(meta, record_hash, record_stats, annotated)
+			if not annotated:
+				skipped+=1
+	if workers > 1:
+		pool.close()
+		pool.join()
+	elif analysis_cache_size is not None:
+		sys.stderr.write(str(morph_pipeline.conf['vm_analyzer'].analysis_cache)+"\n")
+	if sink is not None:
+		sink.close()
+	if manifest is not None:
+		manifest.close()
+		sys.stderr.write("Skipped "+str(skipped)+" records with up to date output.\n")
+	stats.add_timings({'total': time.perf_counter()-start})
+	if args.stats_json:
+		write_json_report(stats, args.stats_json)
+	if args.stats_csv:
+		write_csv_report(stats, args.stats_csv)
 	#Agregate the statistics
 	results={}
-	for location in records:
-		if records[location] > 0:
+	for location in stats.locations:
+		records, analysed, unamb, total, unk_title, unk_punct, punct = [stats.count(name, location) for name in CorpusStats.counter_names]
+		if records > 0:
 			# Corrections
 			if subtract_punctuation_analyses:
 				if add_punctuation_analyses:
 					# The punctuation won't be analysed if guessing is disabled
-					total[location] -= punct[location]
-					analysed[location] -= punct[location]
-					unamb[location] -= punct[location]
-					punct[location] = 0
+					total -= punct
+					analysed -= punct
+					unamb -= punct
+					punct = 0
 				else:
 					# If guessing is disabled, the punctuation won't be analysed.
-					total[location] -= unk_punct[location]
-					unk_punct[location] = 0
-			percent_analysed = (analysed[location] * 100.0) / total[location]
-			results_tuple = (records[location], analysed[location], unamb[location], unk_title[location], unk_punct[location], total[location], percent_analysed)
+					total -= unk_punct
+					unk_punct = 0
+			percent_analysed = (analysed * 100.0) / total
+			results_tuple = (records, analysed, unamb, unk_title, unk_punct, total, percent_analysed)
 			results[location]=results_tuple
-	return results, decades_analysed, decades_total, freq_analysed, freq_not_analysed
+	return results, stats
 
 
 
-results_dict, decades_analysed, decades_total, freq_analysed, freq_not_analysed = process_location()
+results_dict, stats = process_location(args.workers, args.incremental)
 
 # Sort the results according to percentages
 # Output the results
@@ -270,24 +392,26 @@ print ()
 print ()
 #Output the results by location and decade
 print ("maakond\t", end="")
-for i in range(1820, 1930, 10):
+for i in range(first_decade, last_decade+10, 10):
 	print (i, "\t\t\t", end="")
 print()
 decades_sum=(defaultdict(int), defaultdict(int))
 for location in results_dict:
 	print (location, "\t", end="")
-	for decade in range(1820, 1930, 10):
+	for decade in range(first_decade, last_decade+10, 10):
 		decade=str(decade)
-		if decade not in decades_total[location] or decades_total[location][decade]==0:
+		decade_analysed=stats.decade_count('decades_analysed', location, decade)
+		decade_total=stats.decade_count('decades_total', location, decade)
+		if decade_total==0:
 			print ("0\t0\t0%\t", end="")
 		else:
-			percentage=decades_analysed[location][decade]/decades_total[location][decade]*100
-			print (decades_analysed[location][decade], "\t", decades_total[location][decade], "\t", round(percentage, 2), "\t", end="")
-		decades_sum[0][decade] += decades_analysed[location][decade]
-		decades_sum[1][decade] += decades_total[location][decade]
+			percentage=decade_analysed/decade_total*100
+			print (decade_analysed, "\t", decade_total, "\t", round(percentage, 2), "\t", end="")
+		decades_sum[0][decade] += decade_analysed
+		decades_sum[1][decade] += decade_total
 	print ()
 print ("Kokku\t", end="")
-for decade in range(1820, 1930, 10):
+for decade in range(first_decade, last_decade+10, 10):
 	decade=str(decade)
 	if decade not in decades_sum[1] or decades_sum[1][decade]==0:
 		print ("0\t0\t0%\t", end="")
@@ -300,28 +424,22 @@ print()
 print ("30 sagedasemat analüüsitud ja analüüsimata sõna maakondade kaupa")
 #List of unknown words for outputting them into file
 unknown=[]
-for location in freq_analysed:
+for location in stats.frequencies['freq_analysed']:
 	print (location, end="")
-	sorted_analysed=sorted(freq_analysed[location].items(), key=lambda item: item[1], reverse=True)
-	sorted_not_analysed=sorted(freq_not_analysed[location].items(), key=lambda item: item[1], reverse=True)
+	freq_analysed=stats.word_counter('freq_analysed', location)
+	freq_not_analysed=stats.word_counter('freq_not_analysed', location)
+	top_analysed=freq_analysed.top(30)
+	top_not_analysed=freq_not_analysed.top(30)
 	for i in range(30):
-		a=sorted_analysed[i]
-		b=sorted_not_analysed[i]
+		a=top_analysed[i]
+		b=top_not_analysed[i]
 		print ("\t", a[0], "\t", a[1], "\t", b[0], "\t", b[1])
 		unknown.append(b[0])
-	print ("\tUnikaalseid sõnu\t", len(sorted_analysed), "\t\t", len(sorted_not_analysed))
-	hapax_analysed=0
-	for i in sorted_analysed:
-		if i[1]==1:
-			hapax_analysed+=1
-	hapax_not_analysed=0
-	for i in sorted_not_analysed:
-		if i[1]==1:
-			hapax_not_analysed+=1
-	print ("\tHapax legomena\t", hapax_analysed, "\t\t", hapax_not_analysed)
+	print ("\tUnikaalseid sõnu\t", len(freq_analysed), "\t\t", len(freq_not_analysed))
+	print ("\tHapax legomena\t", freq_analysed.hapax, "\t\t", freq_not_analysed.hapax)
 
 
 unknown=set(unknown)
-with open("tundmatud_sonad.txt", "w") as fout:
+with open(args.unknown_words, "w") as fout:
 	for i in unknown:
 		fout.write(i+"\n")
\ No newline at end of file
@@ -1,17 +1,28 @@
 from estnltk import Text
 import csv
 from bs4 import BeautifulSoup
+from lxml import etree
 import os
 import sys
 import re
+import io
+import json
+import mmap
+import struct
+import hashlib
+import pickle
+import functools
+import estnltk
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from estnltk.taggers.text_segmentation.whitespace_tokens_tagger import WhiteSpaceTokensTagger
 from estnltk.taggers.text_segmentation.pretokenized_text_compound_tokens_tagger import PretokenizedTextCompoundTokensTagger
 from estnltk.taggers.text_segmentation.word_tagger import WordTagger
 from estnltk import Layer
 from estnltk.taggers.morph_analysis.morf_common import _postprocess_root
+#Yields the records of the csv file one by one as (content, meta) tuples
 def read_from_csv(path):
 	with open(path, encoding="utf-8") as fin:
-		records=[]
 		reader=csv.DictReader(fin, delimiter='|', quotechar='"')
 		for row in reader:
 			#Cleanup the texts from html-tags
@@ -21,198 +32,443 @@ def read_from_csv(path):
 				'location':row['maakond'].lower(),
 				'year' : row['year'],
 				'id' : row['id']}
-			records.append((content, meta))
-	return records
+			yield (content, meta)
 
-def read_from_xml(path):
-	records=[]
+#The same html parser that BeautifulSoup uses with "lxml", so that the texts are extracted in the same way
+xml_record_parser=etree.HTMLParser(encoding='utf-8')
+
+#The elements whose text BeautifulSoup's get_text leaves out
+xml_record_skipped_tags=('script', 'style', 'template', 'rt', 'rp')
+
+#Extracts the content, location and year from the raw bytes of an xml record.
+#Only the sisu, vald and aeg elements are read, there is no need for a BeautifulSoup tree.
+def extract_xml_record(data):
+	root=etree.fromstring(data, xml_record_parser)
+	etree.strip_elements(root, *xml_record_skipped_tags, with_tail=False)
+	sisu=next(root.iter("sisu"), None)
+	vald=next(root.iter("vald"), None)
+	aeg=next(root.iter("aeg"), None)
+	content="".join(sisu.itertext())
+	location="".join(vald.itertext()).lower()
+	#Sometimes the date is not written
+	if aeg is not None:
+		date="".join(aeg.itertext())
+		year=date.split(".")[-1]
+	else:
+		year="n.a."
+	return (content, location, year)
+
+def read_file(path):
+	with open(path, 'rb') as fin:
+		return fin.read()
+
+#Lists the files with the given extension in the directory tree, sorted by their paths
+def scan_files(path, extension):
+	file_paths=[]
+	dirs=[path]
+	while dirs:
+		with os.scandir(dirs.pop()) as entries:
+			for entry in entries:
+				if entry.is_dir(follow_symlinks=False):
+					dirs.append(entry.path)
+				elif entry.name.endswith(extension):
+					file_paths.append(entry.path)
+	return sorted(file_paths)
+
+#Reads the files in a pool of threads and parses them in a pool of processes.
+#On networked storage the latency of opening the files dominates, so many files are read at once.
+#Yields the results of parse(file_path, data) in the order of file_paths, at most window files are read ahead.
+def prefetch_files(file_paths, parse, read_threads=8, parse_processes=None, window=256):
+	with ThreadPoolExecutor(read_threads) as readers, ProcessPoolExecutor(parse_processes) as parsers:
+		def read_and_parse(file_path):
+			return parsers.submit(parse, file_path, read_file(file_path))
+		pending=deque()
+		for file_path in file_paths:
+			pending.append(readers.submit(read_and_parse, file_path))
+			if len(pending) >= window:
+				yield pending.popleft().result().result()
+		while pending:
+			yield pending.popleft().result().result()
+
+def parse_xml_file(file_path, data):
+	return extract_xml_record(data)
+
+#Yields the records of the xml files one by one as (content, meta) tuples
+#If read_threads is given, the files are read in parallel and parsed in parse_processes processes.
+#Then the records come in the order of their paths.
+def read_from_xml(path, read_threads=None, parse_processes=None):
 	if os.path.isdir(path):
-		for root, dirs, files in os.walk(path):
-			(head, tail) = os.path.split(root)
-			if len(files) > 0:
-				for file in files:
-					if not file.endswith(".xml"):
-						continue
-					with open(os.path.join(root, file), encoding="utf-8") as fin:
-						content=fin.read()
-					soup=BeautifulSoup(content, "lxml")
-					content=soup.find("sisu").getText()
-					location=soup.find("vald").getText().lower()
-					#Sometimes the date is not written
-					try:
-						date=soup.find("aeg").getText()
-						year=date.split(".")[-1]
-					except AttributeError:
-						year="n.a."
-					#Let's get the id from the filename and remove the extension
-					record_id=file.split(".")[0]
-					meta={'year' : year,
-						'location' : location,
-						'id':record_id}
-					records.append((content, meta))
-	return records
-
-def read_from_tsv(path):
+		if read_threads:
+			file_paths=scan_files(path, ".xml")
+			parsed_records=prefetch_files(file_paths, parse_xml_file, read_threads, parse_processes)
+		else:
+			file_paths=[os.path.join(root, file) for root, dirs, files in os.walk(path) for file in files if file.endswith(".xml")]
+			parsed_records=(parse_xml_file(file_path, read_file(file_path)) for file_path in file_paths)
+		for file_path, (content, location, year) in zip(file_paths, parsed_records):
+			#Let's get the id from the filename and remove the extension
+			record_id=os.path.basename(file_path).split(".")[0]
+			meta={'year' : year,
+				'location' : location,
+				'id':record_id}
+			yield (content, meta)
+
+#Counts the records without parsing their contents.
+#It is used for displaying the progress, so that the records themselves can be read one at a time.
+def count_records(path):
+	if os.path.isdir(path):
+		return sum(1 for root, dirs, files in os.walk(path) for file in files if file.endswith(".xml"))
+	with open(path, encoding="utf-8") as fin:
+		return sum(1 for row in csv.DictReader(fin, delimiter='|', quotechar='"'))
+
+#Parses a manually annotated tsv file.
+#Returns the raw text, the manual analyses of the words and the multiword expressions.
+def parse_tsv_file(file_path, data):
+	reader=csv.reader(io.StringIO(data.decode('utf-8'), newline=None), delimiter='\t')
+	words=[]
+	#Lines containing a word and its' analysis
+	word=[]
+	#Morphological analysis of the whole text.
+	morph_analysis=[]
+	raw_text=""
+	multiword_expressions = []
+	for index, row in enumerate(reader):
+		row[0]=row[0].strip()
+		#Check if the row has correct number of elements
+		#If there are less than 6 then it is probably an adverb, abbreviation etc.
+		#But if there are more, then there's something wrond and the user has to be notified.
+		if len(row) > 6:
+			#If the elements after the 6th one contain nothing, then we can continue.
+			for x in row[6:]:
+				x=x.strip()
+				if x !="":
+					sys.stderr.write("Something is wrong with the following file: "+os.path.basename(file_path)+" In the following line: "+str(index+1)+"\n"+"\t".join(row)+"\n")
+					sys.exit(1)
+		#If the first element of a row is empty then it is an alternative analysis of a word.
+		if row[0]=="" and word:
+			word.append(row)
+		else:
+			if len(word) != 0:
+				words.append(word)
+			#After appending the word into the words list let's initialize a new word.
+			word=[row]
+	#As the loop terminates before adding the last word into the list, let's do it now
+	words.append(word)
+	for word in words:
+		#Iterate over the analyses and check for manual fixes.
+		#Remove all other analyses if they exist.
+		type_of_fix=""
+		for analysis in word:
+			#As it may be sometimes necessary to look at the whole line, join the elements of a row back together.
+			line="\t".join(analysis)
+			if "¤" in line:
+				word[0][1:]=[None, None, None, None, None]
+				word=[word[0]]
+				
+				type_of_fix="No_correct_analysis_available"
+				break
+			elif analysis[1].startswith("@"):
+				word[0][1:]=analysis[1:]
+				word=[word[0]]
+				word[0][1]=word[0][1].strip("@")
+				type_of_fix="correct_analysis_provided"
+				break
+			elif analysis[1].startswith("£"):
+				word[0][1:]=analysis[1:]
+				word=[word[0]]
+				word[0][1]=word[0][1].strip("£")
+				type_of_fix="correct_analysis_not_provided"
+				break
+			elif re.match("#[A-Üa-ü0-9]", analysis[1]):
+				word[0][1:]=analysis[1:]
+				word=[word[0]]
+				word[0][1]=word[0][1].strip("#")
+				type_of_fix="correct_analysis_manually_added"
+				break
+		analyses=[]
+		for a in word:
+			analysis={}
+			analysis['root']=a[1]
+			#If it is an abbreviation some fields may be missing.
+			#Sometimes there are also missing tabs in the end of a line, so the last element has to be checked.
+			if a[-1]=="Y" or a[-1]=='D' or a[-1]=='K':
+				analysis['partofspeech']=a[-1]
+				analysis['ending']=""
+				analysis['form']=""
+				analysis['clitic']=""
+			else:
+				analysis['ending']=a[2]
+				analysis['clitic']=a[3]
+				analysis['partofspeech']=a[4]
+				analysis['form']=a[5] if len(a) ==6 else ""
+			if analysis['root']!=None:
+				analysis['root'], analysis['root_tokens'], analysis['lemma'] = _postprocess_root( analysis['root'], analysis['partofspeech'])
+			else:
+				analysis['root_tokens']=None
+				analysis['lemma'] =None
+			analysis['type_of_fix']=type_of_fix
+			#If not otherwize specified the normalized_text will remain the same as the word form
+			analysis['normalized_text']=word[0][0]
+			analyses.append(analysis)
+		#if len(analyses) > 1:
+		#	print (analyses)
+		word_tuple=(word[0][0], analyses)
+		morph_analysis.append(word_tuple)
+		raw_text+=word[0][0]+" "
+		if ' ' in word[0][0]:
+			multiword_expressions.append(word[0][0])
+	return (raw_text, morph_analysis, multiword_expressions)
+
+#Makes the text object with the manual_morph and type_of_fix layers from the parsed tsv file.
+def make_manual_text(file_path, parsed, tokens_tagger):
+	(raw_text, morph_analysis, multiword_expressions)=parsed
+	text = Text(raw_text)
+	
+	tokens_layer=tokens_tagger.make_layer(text)
+	multiword_expressions = [mw.split() for mw in multiword_expressions]
+	compound_tokens_tagger = PretokenizedTextCompoundTokensTagger( multiword_units = multiword_expressions )
+	compound_tokens_layer=compound_tokens_tagger.make_layer(text, layers={'tokens':tokens_layer})
+	word_tagger=WordTagger()
+	words_layer=word_tagger.make_layer(text, layers={'compound_tokens':compound_tokens_layer, 'tokens':tokens_layer})
+	#text.tag_layer(['sentences'])
+	layer_morph=Layer(name='manual_morph',
+		text_object=text,
+		attributes=['root', 'lemma', 'root_tokens', 'ending', 'clitic', 'partofspeech', 'form'],
+		ambiguous=True)
+	layer_fix=Layer(name='type_of_fix',
+		text_object=text,
+		attributes=['type_of_fix'],
+		parent='manual_morph')
+	
+	for ind, word in enumerate(words_layer):
+		layer_fix.add_annotation((word.start, word.end), type_of_fix=morph_analysis[ind][1][0]['type_of_fix'])
+		for analysis in morph_analysis[ind][1]:
+			layer_morph.add_annotation((word.start, word.end), **analysis)
+	text.add_layer(layer_morph)
+	text.add_layer(layer_fix)
+	text.meta['id']=os.path.basename(file_path).split(".")[0]
+	text.meta['location']=os.path.basename(os.path.dirname(file_path)).lower()
+	return text
+
+#The version of the cached text objects. It has to be changed, when parse_tsv_file or make_manual_text changes.
+tsv_cache_version='1'
+
+#The key of a tsv file in the cache. It depends on the contents of the file and the versions of the cache and EstNLTK (if it is known).
+def tsv_cache_key(data):
+	return hashlib.sha256(data+('|'+tsv_cache_version+'|'+getattr(estnltk, '__version__', '')).encode('utf-8')).hexdigest()
+
+#Parses the tsv file and returns it with its cache key, which is also the hash of its contents.
+def parse_tsv_file_keyed(file_path, data):
+	return (tsv_cache_key(data), parse_tsv_file(file_path, data))
+
+#Parses the tsv file, unless the text object made from it is already in the cache.
+#Returns the cache key and the parsed file (or None, if it is cached).
+def parse_tsv_file_cached(file_path, data, cache_dir):
+	cache_key=tsv_cache_key(data)
+	if os.path.exists(os.path.join(cache_dir, cache_key+'.pickle')):
+		return (cache_key, None)
+	return (cache_key, parse_tsv_file(file_path, data))
+
+def load_cached_text(cache_dir, cache_key, file_path):
+	with open(os.path.join(cache_dir, cache_key+'.pickle'), 'rb') as fin:
+		text=pickle.load(fin)
+	#The same contents may be in several files, so the metadata comes from the path
+	text.meta['id']=os.path.basename(file_path).split(".")[0]
+	text.meta['location']=os.path.basename(os.path.dirname(file_path)).lower()
+	return text
+
+def store_cached_text(cache_dir, cache_key, text):
+	cache_file=os.path.join(cache_dir, cache_key+'.pickle')
+	with open(cache_file+'.tmp', 'wb') as fout:
+		pickle.dump(text, fout, protocol=pickle.HIGHEST_PROTOCOL)
+	os.replace(cache_file+'.tmp', cache_file)
+
+#Reads the manually annotated tsv files.
+#If read_threads is given, the files are read in parallel and parsed in parse_processes processes.
+#Then the texts come in the order of their paths.
+#If cache_dir is given, the text objects are cached there by the contents of the files, so that only the changed files are parsed again.
+#The hash of the contents of each file is in the tsv_hash metadata of its text.
+def read_from_tsv(path, read_threads=None, parse_processes=None, cache_dir=None):
 	texts=[]
 	tokens_tagger = WhiteSpaceTokensTagger()
 	if os.path.isdir(path):
-		for root, dirs, files in os.walk(path):
-			(head, tail) = os.path.split(root)
-			if len(files) > 0:
-				for file in files:
-					if not file.endswith(".tsv"):
-						continue
-					with open(os.path.join(root, file), encoding="utf-8") as fin:	
-						reader=csv.reader(fin, delimiter='\t')
-						words=[]
-						#Lines containing a word and its' analysis
-						word=[]
-						#Morphological analysis of the whole text.
-						morph_analysis=[]
-						raw_text=""
-						multiword_expressions = []
-						for index, row in enumerate(reader):
-							row[0]=row[0].strip()
-							#Check if the row has correct number of elements
-							#If there are less than 6 then it is probably an adverb, abbreviation etc.
-							#But if there are more, then there's something wrond and the user has to be notified.
-							if len(row) > 6:
-								#If the elements after the 6th one contain nothing, then we can continue.
-								for x in row[6:]:
-									x=x.strip()
-									if x !="":
-										sys.stderr.write("Something is wrong with the following file: "+file+" In the following line: "+str(index+1)+"\n"+"\t".join(row)+"\n")
-										sys.exit(1)
-							#If the first element of a row is empty then it is an alternative analysis of a word.
-							if row[0]=="" and word:
-								word.append(row)
-							else:
-								if len(word) != 0:
-									words.append(word)
-								#After appending the word into the words list let's initialize a new word.
-								word=[row]
-						#As the loop terminates before adding the last word into the list, let's do it now
-						words.append(word)
-						for word in words:
-							#Iterate over the analyses and check for manual fixes.
-							#Remove all other analyses if they exist.
-							type_of_fix=""
-							for analysis in word:
-								#As it may be sometimes necessary to look at the whole line, join the elements of a row back together.
-								line="\t".join(analysis)
-								if "¤" in line:
-									word[0][1:]=[None, None, None, None, None]
-									word=[word[0]]
-									
-									type_of_fix="No_correct_analysis_available"
-									break
-								elif analysis[1].startswith("@"):
-									word[0][1:]=analysis[1:]
-									word=[word[0]]
-									word[0][1]=word[0][1].strip("@")
-									type_of_fix="correct_analysis_provided"
-									break
-								elif analysis[1].startswith("£"):
-									word[0][1:]=analysis[1:]
-									word=[word[0]]
-									word[0][1]=word[0][1].strip("£")
-									type_of_fix="correct_analysis_not_provided"
-									break
-								elif re.match("#[A-Üa-ü0-9]", analysis[1]):
-									word[0][1:]=analysis[1:]
-									word=[word[0]]
-									word[0][1]=word[0][1].strip("#")
-									type_of_fix="correct_analysis_manually_added"
-									break
-							analyses=[]
-							for a in word:
-								analysis={}
-								analysis['root']=a[1]
-								#If it is an abbreviation some fields may be missing.
-								#Sometimes there are also missing tabs in the end of a line, so the last element has to be checked.
-								if a[-1]=="Y" or a[-1]=='D' or a[-1]=='K':
-									analysis['partofspeech']=a[-1]
-									analysis['ending']=""
-									analysis['form']=""
-									analysis['clitic']=""
-								else:
-									analysis['ending']=a[2]
-									analysis['clitic']=a[3]
-									analysis['partofspeech']=a[4]
-									analysis['form']=a[5] if len(a) ==6 else ""
-								if analysis['root']!=None:
-									analysis['root'], analysis['root_tokens'], analysis['lemma'] = _postprocess_root( analysis['root'], analysis['partofspeech'])
-								else:
-									analysis['root_tokens']=None
-									analysis['lemma'] =None
-								analysis['type_of_fix']=type_of_fix
-								#If not otherwize specified the normalized_text will remain the same as the word form
-								analysis['normalized_text']=word[0][0]
-								analyses.append(analysis)
-							#if len(analyses) > 1:
-							#	print (analyses)
-							word_tuple=(word[0][0], analyses)
-							morph_analysis.append(word_tuple)
-							raw_text+=word[0][0]+" "
-							if ' ' in word[0][0]:
-								multiword_expressions.append(word[0][0])
-						text = Text(raw_text)
-						
-						tokens_layer=tokens_tagger.make_layer(text)
-						multiword_expressions = [mw.split() for mw in multiword_expressions]
-						compound_tokens_tagger = PretokenizedTextCompoundTokensTagger( multiword_units = multiword_expressions )
-						compound_tokens_layer=compound_tokens_tagger.make_layer(text, layers={'tokens':tokens_layer})
-						word_tagger=WordTagger()
-						words_layer=word_tagger.make_layer(text, layers={'compound_tokens':compound_tokens_layer, 'tokens':tokens_layer})
-						#text.tag_layer(['sentences'])
-						layer_morph=Layer(name='manual_morph',
-							text_object=text,
-							attributes=['root', 'lemma', 'root_tokens', 'ending', 'clitic', 'partofspeech', 'form'],
-							ambiguous=True)
-						layer_fix=Layer(name='type_of_fix',
-							text_object=text,
-							attributes=['type_of_fix'],
-							parent='manual_morph')
-						
-						for ind, word in enumerate(words_layer):
-							layer_fix.add_annotation((word.start, word.end), type_of_fix=analysis['type_of_fix'])
-							for analysis in morph_analysis[ind][1]:
-								layer_morph.add_annotation((word.start, word.end), **analysis)
-						text.add_layer(layer_morph)
-						text.add_layer(layer_fix)
-						text.meta['id']=file.split(".")[0]
-						text.meta['location']=root.split(os.sep)[-1].lower()
-						texts.append(text)
+		if cache_dir:
+			os.makedirs(cache_dir, exist_ok=True)
+			parse=functools.partial(parse_tsv_file_cached, cache_dir=cache_dir)
+		else:
+			parse=parse_tsv_file_keyed
+		if read_threads:
+			file_paths=scan_files(path, ".tsv")
+			parsed_files=prefetch_files(file_paths, parse, read_threads, parse_processes)
+		else:
+			file_paths=[os.path.join(root, file) for root, dirs, files in os.walk(path) for file in files if file.endswith(".tsv")]
+			parsed_files=(parse(file_path, read_file(file_path)) for file_path in file_paths)
+		for file_path, (cache_key, parsed) in zip(file_paths, parsed_files):
+			if parsed is None:
+				text=load_cached_text(cache_dir, cache_key, file_path)
+			else:
+				text=make_manual_text(file_path, parsed, tokens_tagger)
+				if cache_dir:
+					store_cached_text(cache_dir, cache_key, text)
+			text.meta['tsv_hash']=cache_key
+			texts.append(text)
 	return texts
 
 
 
-def read_corpus(path):
-	sys.stderr.write("Reading corpus.\n")
+#The corpus cache file consists of a header, the records and the index of the records.
+#Header: magic string, number of records, offset of the index and the fingerprint of the source corpus.
+#Index: for each record the offset and length of its text and the offset and length of its metadata (json).
+corpus_cache_magic=b'OECORP01'
+corpus_cache_header=struct.Struct('<8sQQ64s')
+corpus_cache_index_entry=struct.Struct('<QQQQ')
+
+#Makes the fingerprint of the source corpus for checking if the cache is up to date.
+#By default the sizes and modification times of the files are used, with hash_contents=True their contents.
+#The order of the records depends on whether the files are read in parallel, so it is a part of the fingerprint.
+def corpus_fingerprint(path, hash_contents=False, sorted_order=False):
 	if os.path.isdir(path):
-		records=read_from_xml(path)
-	elif os.path.isfile(path):
-		if path.endswith("csv"):
-			records=read_from_csv(path)
+		file_paths=scan_files(path, ".xml")
+	else:
+		file_paths=[path]
+	fingerprint=hashlib.sha256()
+	fingerprint.update(b'sorted' if sorted_order else b'walk')
+	for file_path in file_paths:
+		fingerprint.update(os.path.relpath(file_path, path).encode('utf-8')+b'\0')
+		if hash_contents:
+			fingerprint.update(hashlib.sha256(read_file(file_path)).digest())
+		else:
+			stat=os.stat(file_path)
+			fingerprint.update(struct.pack('<QQ', stat.st_size, stat.st_mtime_ns))
+	return fingerprint.hexdigest().encode('ascii')
+
+class CorpusCache:
+    """A memory-mapped cache of the cleaned records of a corpus.
+       The records can be iterated in the original order or looked up by their id."""
+    
+    def __init__(self, cache_path):
+        self.cache_path = cache_path
+        with open(cache_path, 'rb') as fin:
+            self._data = mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, self.record_count, index_offset, self.fingerprint) = corpus_cache_header.unpack_from(self._data, 0)
+        if magic != corpus_cache_magic:
+            self.close()
+            raise ValueError('(!) {!r} is not a corpus cache file'.format(cache_path))
+        self._index_offset = index_offset
+        self._ids = None
+    
+    def __len__(self):
+        return self.record_count
+    
+    def _read(self, offset, length):
+        return self._data[offset:offset+length].decode('utf-8')
+    
+    def record(self, record_number):
+        (text_offset, text_length, meta_offset, meta_length) = corpus_cache_index_entry.unpack_from(self._data, self._index_offset+record_number*corpus_cache_index_entry.size)
+        return (self._read(text_offset, text_length), json.loads(self._read(meta_offset, meta_length)))
+    
+    def __iter__(self):
+        for record_number in range(self.record_count):
+            yield self.record(record_number)
+    
+    def get(self, record_id):
+        """Returns the record with the given id or None, if there is no such record."""
+        if self._ids is None:
+            # The metadata is decoded only for the first lookup
+            self._ids = {}
+            for record_number in range(self.record_count):
+                (text_offset, text_length, meta_offset, meta_length) = corpus_cache_index_entry.unpack_from(self._data, self._index_offset+record_number*corpus_cache_index_entry.size)
+                self._ids[json.loads(self._read(meta_offset, meta_length))['id']] = record_number
+        if record_id not in self._ids:
+            return None
+        return self.record(self._ids[record_id])
+    
+    def close(self):
+        self._data.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+#Opens the corpus cache, if it exists and was made from the same source corpus. Otherwise returns None.
+def open_corpus_cache(cache_path, fingerprint):
+	if not os.path.isfile(cache_path):
+		return None
+	try:
+		cache=CorpusCache(cache_path)
+	except (ValueError, struct.error):
+		return None
+	if cache.fingerprint != fingerprint:
+		cache.close()
+		return None
+	return cache
+
+#Writes the records into the corpus cache while passing them on.
+#The cache is written into a temporary file, which replaces the old cache only when all the records have been read.
+def write_corpus_cache(cache_path, records, fingerprint):
+	index=[]
+	with open(cache_path+'.tmp', 'wb') as fout:
+		fout.write(corpus_cache_header.pack(corpus_cache_magic, 0, 0, fingerprint))
+		offset=corpus_cache_header.size
+		for content, meta in records:
+			text_bytes=content.encode('utf-8')
+			meta_bytes=json.dumps(meta, ensure_ascii=False).encode('utf-8')
+			fout.write(text_bytes)
+			fout.write(meta_bytes)
+			index.append((offset, len(text_bytes), offset+len(text_bytes), len(meta_bytes)))
+			offset+=len(text_bytes)+len(meta_bytes)
+			yield (content, meta)
+		for entry in index:
+			fout.write(corpus_cache_index_entry.pack(*entry))
+		fout.seek(0)
+		fout.write(corpus_cache_header.pack(corpus_cache_magic, len(index), offset, fingerprint))
+	os.replace(cache_path+'.tmp', cache_path)
+
+#Reads the corpus and yields the records as text objects.
+#If cache_path is given, the cleaned records are read from there or the cache is made for the next runs.
+def read_corpus(path, read_threads=None, parse_processes=None, cache_path=None):
+	sys.stderr.write("Reading corpus.\n")
+	cache=None
+	if cache_path:
+		fingerprint=corpus_fingerprint(path, sorted_order=bool(read_threads))
+		cache=open_corpus_cache(cache_path, fingerprint)
+	if cache is not None:
+		records=iter(cache)
+		record_count=len(cache)
+	else:
+		if os.path.isdir(path):
+			records=read_from_xml(path, read_threads, parse_processes)
+		elif os.path.isfile(path):
+			if path.endswith("csv"):
+				records=read_from_csv(path)
+		record_count=count_records(path)
+		if cache_path:
+			records=write_corpus_cache(cache_path, records, fingerprint)
 	#In order to display the progress, initialise the counter
 	count=0
 	#In order not to bombard the stderr, let's initialise the displayed progress value and if it differs from the progress, we will update and display it.
 	percent_displayed=""
 	progress=""
-	for i in records:
-		#text=i[0].replace("\n\n", "\n")
-		text=i[0]
-		#text=text.replace(chr(10), "")
-		#text = os.linesep.join([s for s in text.splitlines() if s])
-		text=Text(text)
-		text.meta=i[1]
-		count+=1
-		percent=int(count*100/len(records))
-		if percent != percent_displayed:
-			percent_displayed=percent
-			progress="Working with records "+str(percent_displayed).rjust(3)+"%"
-			sys.stderr.write("\r"+progress)
-			sys.stderr.flush()
-
-		yield text
+	#The cache is closed also when the records are not read to the end
+	try:
+		for i in records:
+			#text=i[0].replace("\n\n", "\n")
+			text=i[0]
+			#text=text.replace(chr(10), "")
+			#text = os.linesep.join([s for s in text.splitlines() if s])
+			text=Text(text)
+			text.meta=i[1]
+			count+=1
+			percent=int(count*100/record_count)
+			if percent != percent_displayed:
+				percent_displayed=percent
+				progress="Working with records "+str(percent_displayed).rjust(3)+"%"
+				sys.stderr.write("\r"+progress)
+				sys.stderr.flush()
+
+			yield text
+	finally:
+		if cache is not None:
+			cache.close()
 	sys.stderr.write("\n")
\ No newline at end of file
@@ -0,0 +1,293 @@
+#The statistics of the morphological analysis of a corpus.
+#They are collected in one pass over the morph_analysis layer of each text
+#and the statistics of several processes or runs can be merged.
+#The statistics can be saved as a json report or as csv files, and the reports of several runs can be merged.
+import os
+import csv
+import json
+import heapq
+from operator import itemgetter
+from estnltk.taggers.morph_analysis.morf_common import _is_empty_annotation
+
+class WordCounter:
+    """Counts the word forms and keeps the number of hapax legomena up to date.
+       The words keep the order of their first occurrence, so that the words of the same frequency
+       are listed in the order they appeared in.
+       If capacity is given, at most that many words are counted (Space-Saving): a new word replaces
+       the least frequent one and gets its count, so the counts of the frequent words are upper bounds
+       and the number of words and hapax legomena are those of the counted words."""
+
+    def __init__(self, capacity=None):
+        self.capacity = capacity
+        self.counts = {}
+        self.hapax = 0
+        # The lazy min-heap of (count, word) entries for finding the least frequent word
+        self._heap = []
+
+    def __len__(self):
+        return len(self.counts)
+
+    def __contains__(self, word):
+        return word in self.counts
+
+    def __getitem__(self, word):
+        return self.counts.get(word, 0)
+
+    def add(self, word, count=1):
+        old_count = self.counts.get(word)
+        if old_count is None:
+            new_count = count
+            if self.capacity is not None and len(self.counts) >= self.capacity:
+                # The evicted word is already taken out of the hapax legomena
+                new_count += self._evict()
+        else:
+            new_count = old_count+count
+            if old_count == 1:
+                self.hapax -= 1
+        self.counts[word] = new_count
+        if new_count == 1:
+            self.hapax += 1
+        if self.capacity is not None:
+            heapq.heappush(self._heap, (new_count, word))
+            if len(self._heap) > 2*self.capacity:
+                self._heap = [(count, word) for word, count in self.counts.items()]
+                heapq.heapify(self._heap)
+
+    def _evict(self):
+        # Removes the least frequent word and returns its count
+        while True:
+            count, word = heapq.heappop(self._heap)
+            if self.counts.get(word) == count:
+                break
+        del self.counts[word]
+        if count == 1:
+            self.hapax -= 1
+        return count
+
+    def merge(self, other):
+        for word, count in other.counts.items():
+            self.add(word, count)
+
+    def top(self, k):
+        """The k most frequent words as (word, count) pairs, the same as the first k of the sorted counts."""
+        return heapq.nlargest(k, self.counts.items(), key=itemgetter(1))
+
+    def items(self):
+        return self.counts.items()
+
+class CorpusStats:
+    """The statistics of the analysed texts by location: the counts of the records and the words,
+       the analysed, unambiguous and unknown words, the words by decade and the frequencies of the
+       analysed and unanalysed word forms.
+       If max_word_types is given, the frequencies keep at most that many word forms per location (see WordCounter).
+       The statistics can be converted into plain dicts, which can be sent between the processes and saved as json.
+       The timings are the seconds spent in the stages of the processing, summed over the processes."""
+    counter_names = ['records', 'analysed', 'unamb', 'total', 'unk_title', 'unk_punct', 'punct']
+    decade_names = ['decades_analysed', 'decades_total']
+    frequency_names = ['freq_analysed', 'freq_not_analysed']
+
+    def __init__(self, max_word_types=None):
+        self.max_word_types = max_word_types
+        self.counters = {name: {} for name in self.counter_names}
+        self.decades = {name: {} for name in self.decade_names}
+        self.frequencies = {name: {} for name in self.frequency_names}
+        self.timings = {}
+        self.runs = 1
+
+    @property
+    def locations(self):
+        """The locations in the order of their first records."""
+        return list(self.counters['records'])
+
+    def count(self, name, location):
+        return self.counters[name].get(location, 0)
+
+    def decade_count(self, name, location, decade):
+        return self.decades[name].get(location, {}).get(decade, 0)
+
+    def word_counter(self, name, location):
+        """The WordCounter of the location, it is created if the location has none yet."""
+        table = self.frequencies[name]
+        if location not in table:
+            table[location] = WordCounter(self.max_word_types)
+        return table[location]
+
+    def _add_count(self, name, location, count=1):
+        counter = self.counters[name]
+        counter[location] = counter.get(location, 0)+count
+
+    def _add_decade(self, name, location, decade, count=1):
+        table = self.decades[name].setdefault(location, {})
+        table[decade] = table.get(decade, 0)+count
+
+    def add_timings(self, timings):
+        for stage, seconds in timings.items():
+            self.timings[stage] = self.timings.get(stage, 0.0)+seconds
+
+    def decade_list(self):
+        """The decades that have words, in sorted order."""
+        return sorted({decade for table in self.decades['decades_total'].values() for decade in table})
+
+    def add_text(self, text):
+        """Adds the counts of the analysed text."""
+        location = text.meta['location']
+        self._add_count('records', location)
+        #Change the year into decade
+        decade = text.meta['year'][:-1]+"0"
+        analysed = unamb = total = unk_title = unk_punct = punct = 0
+        freq_analysed = None
+        freq_not_analysed = None
+        for word in text.morph_analysis:
+            is_punct = len(word.text) > 0 and not any([c.isalnum() for c in word.text])
+            total += 1
+            if not _is_empty_annotation( word.annotations[0] ):
+                analysed += 1
+                if not is_punct:
+                    if freq_analysed is None:
+                        freq_analysed = self.word_counter('freq_analysed', location)
+                    freq_analysed.add(word.text)
+                if len(word.annotations) == 1:
+                    unamb += 1
+                # Save the type of regular word
+                if is_punct:
+                    punct += 1
+            else:
+                if freq_not_analysed is None:
+                    freq_not_analysed = self.word_counter('freq_not_analysed', location)
+                freq_not_analysed.add(word.text)
+                # save the type of unknown word
+                if len(word.text) > 0:
+                    if word.text[0].isupper():
+                        unk_title += 1
+                    if is_punct:
+                        unk_punct += 1
+        for name, count in (('analysed', analysed), ('unamb', unamb), ('total', total),
+                            ('unk_title', unk_title), ('unk_punct', unk_punct), ('punct', punct)):
+            if count > 0:
+                self._add_count(name, location, count)
+        if analysed > 0:
+            self._add_decade('decades_analysed', location, decade, analysed)
+        if total > 0:
+            self._add_decade('decades_total', location, decade, total)
+
+    def merge(self, other):
+        """Adds the statistics of other. As they are added in the order of the records,
+           the words keep the order of their first occurrence."""
+        for name in self.counter_names:
+            for location, count in other.counters[name].items():
+                self._add_count(name, location, count)
+        for name in self.decade_names:
+            for location, table in other.decades[name].items():
+                for decade, count in table.items():
+                    self._add_decade(name, location, decade, count)
+        for name in self.frequency_names:
+            for location, counter in other.frequencies[name].items():
+                self.word_counter(name, location).merge(counter)
+        self.add_timings(other.timings)
+
+    def to_plain(self):
+        plain = {name: dict(self.counters[name]) for name in self.counter_names}
+        for name in self.decade_names:
+            plain[name] = {location: dict(table) for location, table in self.decades[name].items()}
+        for name in self.frequency_names:
+            plain[name] = {location: dict(counter.counts) for location, counter in self.frequencies[name].items()}
+        return plain
+
+    @classmethod
+    def from_plain(cls, plain, max_word_types=None):
+        stats = cls(max_word_types)
+        for name in cls.counter_names:
+            for location, count in plain[name].items():
+                stats._add_count(name, location, count)
+        for name in cls.decade_names:
+            for location, table in plain[name].items():
+                for decade, count in table.items():
+                    stats._add_decade(name, location, decade, count)
+        for name in cls.frequency_names:
+            for location, counts in plain[name].items():
+                counter = stats.word_counter(name, location)
+                for word, count in counts.items():
+                    counter.add(word, count)
+        return stats
+
+    def to_report(self):
+        """The statistics as a json serializable report, the counts are by location.
+           The counts are as they were collected, the punctuation is not subtracted."""
+        locations = {}
+        for location in self.locations:
+            decades = {}
+            for decade in sorted(self.decades['decades_total'].get(location, {})):
+                decades[decade] = {'analysed': self.decade_count('decades_analysed', location, decade),
+                                   'total': self.decade_count('decades_total', location, decade)}
+            locations[location] = {name: self.count(name, location) for name in self.counter_names}
+            locations[location]['decades'] = decades
+            for name in self.frequency_names:
+                counter = self.frequencies[name].get(location)
+                locations[location][name] = dict(counter.counts) if counter is not None else {}
+        return {'version': stats_report_version, 'runs': self.runs, 'max_word_types': self.max_word_types,
+                'timings': dict(self.timings), 'locations': locations}
+
+    @classmethod
+    def from_report(cls, report, max_word_types=None):
+        if report.get('version') != stats_report_version:
+            raise ValueError('(!) Unexpected version of the statistics report: {!r}'.format(report.get('version')))
+        stats = cls(max_word_types)
+        stats.runs = report['runs']
+        stats.add_timings(report['timings'])
+        for location, location_report in report['locations'].items():
+            for name in cls.counter_names:
+                if location_report[name] > 0 or name == 'records':
+                    stats._add_count(name, location, location_report[name])
+            for decade, counts in location_report['decades'].items():
+                for name, key in (('decades_analysed', 'analysed'), ('decades_total', 'total')):
+                    if counts[key] > 0:
+                        stats._add_decade(name, location, decade, counts[key])
+            for name in cls.frequency_names:
+                if location_report[name]:
+                    counter = stats.word_counter(name, location)
+                    for word, count in location_report[name].items():
+                        counter.add(word, count)
+        return stats
+
+#The version of the statistics reports
+stats_report_version = 1
+
+def write_json_report(stats, path):
+	with open(path, 'w', encoding='utf-8') as fout:
+		json.dump(stats.to_report(), fout, ensure_ascii=False, indent=1)
+
+def read_json_report(path, max_word_types=None):
+	with open(path, encoding='utf-8') as fin:
+		return CorpusStats.from_report(json.load(fin), max_word_types)
+
+#Merges the statistics of the reports of several runs or shards
+def merge_reports(paths, max_word_types=None):
+	merged = None
+	for path in paths:
+		stats = read_json_report(path, max_word_types)
+		if merged is None:
+			merged = stats
+		else:
+			merged.merge(stats)
+			merged.runs += stats.runs
+	return merged
+
+#Writes the statistics as csv files into the directory:
+#locations.csv, decades.csv, analysed_words.csv, unknown_words.csv and timings.csv
+def write_csv_report(stats, directory):
+	os.makedirs(directory, exist_ok=True)
+	def write_rows(file_name, header, rows):
+		with open(os.path.join(directory, file_name), 'w', encoding='utf-8', newline='') as fout:
+			writer = csv.writer(fout)
+			writer.writerow(header)
+			writer.writerows(rows)
+	write_rows('locations.csv', ['location']+CorpusStats.counter_names,
+		([location]+[stats.count(name, location) for name in CorpusStats.counter_names] for location in stats.locations))
+	write_rows('decades.csv', ['location', 'decade', 'analysed', 'total'],
+		([location, decade, stats.decade_count('decades_analysed', location, decade), stats.decade_count('decades_total', location, decade)]
+			for location in stats.locations for decade in sorted(stats.decades['decades_total'].get(location, {}))))
+	for name, file_name in (('freq_analysed', 'analysed_words.csv'), ('freq_not_analysed', 'unknown_words.csv')):
+		write_rows(file_name, ['location', 'word', 'count'],
+			([location, word, count] for location, counter in stats.frequencies[name].items()
+				for word, count in sorted(counter.items(), key=itemgetter(1), reverse=True)))
+	write_rows('timings.csv', ['stage', 'seconds'], ([stage, '{:.3f}'.format(seconds)] for stage, seconds in stats.timings.items()))
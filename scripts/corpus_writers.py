@@ -0,0 +1,142 @@
+#Writes the morphological analyses of the texts as tsv files or as columnar files (Parquet or Arrow IPC).
+import os
+import re
+from estnltk.taggers.morph_analysis.morf_common import _is_empty_annotation
+
+#The rows are formatted as csv.writer formats them with the tab as the delimiter
+tsv_fieldnames=['word', 'root', 'ending', 'clitic', 'partofspeech', 'form']
+tsv_quoted_characters=re.compile('[\t"\r\n]')
+tsv_line_end='\r\n'
+tsv_sentence_start='<s>\t\t\t\t\t'+tsv_line_end
+tsv_sentence_end='</s>\t\t\t\t\t'+tsv_line_end
+
+#Formats the value as a tsv field
+def tsv_field(value):
+	if value is None:
+		return ''
+	value=str(value)
+	if tsv_quoted_characters.search(value):
+		return '"'+value.replace('"', '""')+'"'
+	return value
+
+#Formats the analyses of the text as a tsv file, a row for each analysis of a word.
+#The words without analyses get the row with ####. If the sentence boundaries (start, end) are given,
+#the sentences are marked with the <s> and </s> rows.
+def format_analysis_tsv(text, sentence_boundaries=None, add_headers=False, file_name=None):
+	use_boundaries=sentence_boundaries is not None and len(sentence_boundaries) > 0
+	#The rows are collected and joined at once
+	rows=[]
+	if add_headers:
+		rows.append('\t'.join(tsv_fieldnames)+tsv_line_end)
+	sentence_id=0
+	sentence_start, sentence_end=sentence_boundaries[0] if use_boundaries else (None, None)
+	for word in text.morph_analysis:
+		analyses=word.annotations
+		#Beginning of sentence
+		if use_boundaries and word.start == sentence_start:
+			rows.append(tsv_sentence_start)
+		word_text=tsv_field(word.text)
+		#Output the word analyses, if they exist
+		if not _is_empty_annotation(analyses[0]):
+			for aid, analysis in enumerate(analyses):
+				rows.append('\t'.join([word_text if aid == 0 else ' '*len(word.text), tsv_field(analysis['root']),
+					tsv_field(analysis['ending']), tsv_field(analysis['clitic']), tsv_field(analysis['partofspeech']),
+					tsv_field(analysis['form'])])+tsv_line_end)
+		#If there are no analyses, output the empty line
+		else:
+			rows.append(word_text+'\t####\t\t\t\t'+tsv_line_end)
+		#End of sentence
+		if use_boundaries and word.end == sentence_end:
+			rows.append(tsv_sentence_end)
+			sentence_id+=1
+			if sentence_id < len(sentence_boundaries):
+				sentence_start, sentence_end=sentence_boundaries[sentence_id]
+	if use_boundaries:
+		assert sentence_id == len(sentence_boundaries), \
+		  '(!) Midagi l2ks lausepiiride panemisel viltu failis '+\
+		   str(file_name)+'; Pandi '+str(sentence_id)+' lausepiiri / '+\
+		   'tegelikult oli '+str(len(sentence_boundaries))+' lausepiiri;'
+	return ''.join(rows)
+
+#Writes the analyses of the text into the tsv file in one call
+def write_analysis_tsv(text, out_file_name, sentence_boundaries=None, add_headers=False):
+	data=format_analysis_tsv(text, sentence_boundaries, add_headers, out_file_name)
+	with open(out_file_name, 'w', encoding='utf-8', newline='\n') as tsvfile:
+		tsvfile.write(data)
+
+#The columns of the columnar output. The unanalysed words have no root, ending, clitic, partofspeech and form.
+columnar_fields=['id', 'sentence', 'word', 'rank', 'root', 'ending', 'clitic', 'partofspeech', 'form']
+
+#Returns the analyses of the text as columns, one row for each analysis of a word
+def analysis_columns(text):
+	columns={field: [] for field in columnar_fields}
+	record_id=str(text.meta['id'])
+	sentence_ends=[sentence.end for sentence in text['sentences']]
+	sentence_id=0
+	for word in text.morph_analysis:
+		while sentence_id < len(sentence_ends)-1 and word.start >= sentence_ends[sentence_id]:
+			sentence_id+=1
+		analyses=word.annotations
+		if _is_empty_annotation(analyses[0]):
+			analyses=[None]
+		for rank, analysis in enumerate(analyses):
+			columns['id'].append(record_id)
+			columns['sentence'].append(sentence_id)
+			columns['word'].append(word.text)
+			columns['rank'].append(rank)
+			for attr in columnar_fields[4:]:
+				columns[attr].append(None if analysis is None else analysis[attr])
+	return columns
+
+class ColumnarSink:
+    """Writes the analyses of each location into one columnar file, <outputdir>/<location>.parquet (or .arrow for
+       the Arrow IPC format). The rows are buffered and written in row groups of row_group_size rows.
+       The files get their names when the sink is closed, so an interrupted run leaves no partial files."""
+    
+    def __init__(self, outputdir, output_format='parquet', row_group_size=100000):
+        try:
+            import pyarrow
+        except ImportError:
+            raise ImportError('(!) The {} output needs pyarrow, install it with: pip install pyarrow'.format(output_format))
+        self.pyarrow = pyarrow
+        self.outputdir = outputdir
+        self.output_format = output_format
+        self.row_group_size = row_group_size
+        self.schema = pyarrow.schema([('id', pyarrow.string()), ('sentence', pyarrow.int32()), ('word', pyarrow.string()),
+            ('rank', pyarrow.int32())]+[(attr, pyarrow.string()) for attr in columnar_fields[4:]])
+        self.writers = {}
+        self.buffers = {}
+    
+    def _file_name(self, location):
+        return os.path.join(self.outputdir, location+'.'+self.output_format)
+    
+    def _flush(self, location):
+        buffer = self.buffers[location]
+        if not buffer['id']:
+            return
+        if location not in self.writers:
+            if self.output_format == 'parquet':
+                import pyarrow.parquet
+                self.writers[location] = pyarrow.parquet.ParquetWriter(self._file_name(location)+'.tmp', self.schema)
+            else:
+                import pyarrow.ipc
+                self.writers[location] = pyarrow.ipc.new_file(self._file_name(location)+'.tmp', self.schema)
+        table = self.pyarrow.Table.from_pydict(buffer, schema=self.schema)
+        self.writers[location].write_table(table)
+        self.buffers[location] = {field: [] for field in columnar_fields}
+    
+    def add(self, location, columns):
+        if location not in self.buffers:
+            self.buffers[location] = {field: [] for field in columnar_fields}
+        buffer = self.buffers[location]
+        for field in columnar_fields:
+            buffer[field].extend(columns[field])
+        if len(buffer['id']) >= self.row_group_size:
+            self._flush(location)
+    
+    def close(self):
+        for location in self.buffers:
+            self._flush(location)
+        for location, writer in self.writers.items():
+            writer.close()
+            os.replace(self._file_name(location)+'.tmp', self._file_name(location))
@@ -0,0 +1,279 @@
+#The metrics of the evaluation of the automatic morphological analysis against the manually analyzed corpus.
+#The counts of a file are collected by morph_eval_utils.evaluate_morph_analysis and the metrics of
+#several files can be merged, so that the files can be evaluated in separate processes.
+#The errors of the words can be collected into arrays of categorical codes for the confusion matrices and error breakdowns.
+import os
+import csv
+from array import array
+
+class EvalMetrics:
+    """The counts of the evaluation of a file, or of several files after merging, and the metrics calculated from them.
+       The macro-averages are the averages of the metrics of the merged files, the micro-averages (precision,
+       recall, ...) are calculated from the summed counts. The metrics are merged in the order of the files,
+       so the sums and averages do not depend on the number of processes."""
+    count_names = ['total', 'punct', 'unambiguous', 'unambiguous_no_punct', 'ambiguous_correct', 'ambiguous_total',
+                   'ambiguous_analyses', 'incorrectly_analyzed', 'analyzed', 'not_automatically_analyzed', 'not_manually_analyzed']
+    average_names = ['precision', 'recall', 'f_score', 'ambiguous_percentage', 'average_analyses']
+    #The columns of the output, the first ones are the averages
+    column_names = average_names+['total', 'total_no_punct', 'total_manually_analyzed', 'unambiguous', 'unambiguous_no_punct',
+                                  'ambiguous_correct', 'ambiguous_total', 'ambiguous_analyses', 'correctly_analyzed',
+                                  'incorrectly_analyzed', 'analyzed', 'not_automatically_analyzed', 'not_manually_analyzed']
+    column_titles = ['precision', 'recall', 'f-score', 'percentage of ambiguous words', 'average number of analyses per ambiguous word',
+                     'total words', 'total with no punctuation', 'total number of manually analyzed', 'unambiguous',
+                     'unambiguous with no punctuation', 'ambiguous correctly analyzed', 'ambiguously analyzed total',
+                     'ambiguous analyses total', 'correctly analyzed', 'incorrectly analyzed', 'automatically analyzed total',
+                     'not automatically analyzed', 'not manually analyzed']
+
+    def __init__(self, file_id=None, counts=None):
+        self.file_id = file_id
+        self.files = 0
+        for name in self.count_names:
+            setattr(self, name, 0)
+        #The sums of the metrics of the files for the macro-averages
+        self.metric_sums = {name: 0.0 for name in self.average_names}
+        if counts is not None:
+            for name in self.count_names:
+                setattr(self, name, counts[name])
+            self.files = 1
+            for name in self.average_names:
+                self.metric_sums[name] = getattr(self, name)
+
+    @property
+    def total_no_punct(self):
+        return self.total-self.punct
+
+    @property
+    def total_manually_analyzed(self):
+        return self.total_no_punct-self.not_manually_analyzed
+
+    @property
+    def correctly_analyzed(self):
+        return self.unambiguous_no_punct+self.ambiguous_correct
+
+    @property
+    def precision(self):
+        return self.correctly_analyzed/self.analyzed
+
+    @property
+    def recall(self):
+        return self.correctly_analyzed/self.total_manually_analyzed
+
+    @property
+    def f_score(self):
+        return (2*self.precision*self.recall)/(self.precision+self.recall)
+
+    @property
+    def ambiguous_percentage(self):
+        return self.ambiguous_total/self.total*100
+
+    @property
+    def average_analyses(self):
+        return self.ambiguous_analyses/self.ambiguous_total
+
+    def check(self):
+        """Checks that the counts add up: each manually analyzed word that is not punctuation has exactly one
+           outcome, and the automatically analyzed words are the ones with the outcomes other than
+           not_automatically_analyzed. The counts are collected separately, so a word counted twice or not at all fails."""
+        outcomes = self.unambiguous_no_punct+self.ambiguous_correct+self.incorrectly_analyzed
+        assert outcomes+self.not_automatically_analyzed == self.total_manually_analyzed, \
+            '(!) The outcomes of {} do not add up to the manually analyzed words: {} vs {}'.format(
+                self.file_id, outcomes+self.not_automatically_analyzed, self.total_manually_analyzed)
+        assert outcomes == self.analyzed, \
+            '(!) The outcomes of {} do not add up to the automatically analyzed words: {} vs {}'.format(self.file_id, outcomes, self.analyzed)
+        assert self.unambiguous_no_punct <= self.unambiguous and self.ambiguous_correct <= self.ambiguous_total
+
+    def macro_average(self, name):
+        return self.metric_sums[name]/self.files
+
+    def merge(self, other):
+        for name in self.count_names:
+            setattr(self, name, getattr(self, name)+getattr(other, name))
+        for name in self.average_names:
+            self.metric_sums[name] += other.metric_sums[name]
+        self.files += other.files
+
+    def row(self, average='micro'):
+        """The values of the columns. With average='macro' the averages of the metrics of the files are given."""
+        if average == 'macro':
+            values = [self.macro_average(name) for name in self.average_names]
+        else:
+            values = [getattr(self, name) for name in self.average_names]
+        return values+[getattr(self, name) for name in self.column_names[len(self.average_names):]]
+
+    def format_row(self, label, average='micro'):
+        return "\t".join([label]+[str(round(value, 2)) for value in self.row(average)])
+
+class Categories:
+    """The values of a categorical attribute and their integer codes, in the order of their first occurrence."""
+
+    def __init__(self):
+        self.codes = {}
+        self.labels = []
+
+    def __len__(self):
+        return len(self.labels)
+
+    def code(self, label):
+        code = self.codes.get(label)
+        if code is None:
+            code = len(self.labels)
+            self.codes[label] = code
+            self.labels.append(label)
+        return code
+
+    def remap(self, other):
+        """The codes of the labels of other in these categories, the new labels are added."""
+        return [self.code(label) for label in other.labels]
+
+def import_numpy():
+    try:
+        import numpy
+    except ImportError:
+        raise ImportError('(!) The error reports need numpy, install it with: pip install numpy')
+    return numpy
+
+class ErrorCollector:
+    """Collects the outcomes of the words and the alignments of their annotations as integer codes
+       of the categories (location, type_of_fix, word form, part of speech and part of speech with form),
+       so that the confusion matrices and the breakdowns of the errors are counted with NumPy.
+       The codes are kept in arrays of C ints, a collector can be sent from a worker process and merged."""
+    outcome_names = ['unambiguous', 'ambiguous_correct', 'incorrectly_analyzed', 'not_automatically_analyzed']
+    status_names = ['COMMON', 'MODIFIED', 'MISSING', 'EXTRA']
+    category_names = ['locations', 'fixes', 'words', 'partofspeech', 'tags']
+    word_columns = ['word_location', 'word_fix', 'word_type', 'word_outcome']
+    alignment_columns = ['alignment_word', 'alignment_status', 'manual_partofspeech', 'manual_tag', 'auto_partofspeech', 'auto_tag']
+    #The label of the missing annotation in MISSING and EXTRA alignments
+    missing_label = '(none)'
+
+    def __init__(self):
+        for name in self.category_names:
+            setattr(self, name, Categories())
+        for name in self.word_columns+self.alignment_columns:
+            setattr(self, name, array('i'))
+        self._location = None
+        self._pos_id = None
+        self._form_id = None
+
+    def __len__(self):
+        return len(self.word_outcome)
+
+    def start_text(self, location, attributes):
+        """Sets the location of the following words and the attributes of their annotation tuples."""
+        self._location = self.locations.code(location)
+        self._pos_id = attributes.index('partofspeech')
+        self._form_id = attributes.index('form')
+
+    def _codes(self, annotation):
+        # An empty annotation (of a word that is not analyzed) is counted as missing
+        if annotation is None or annotation[self._pos_id] is None:
+            return (self.partofspeech.code(self.missing_label), self.tags.code(self.missing_label))
+        pos = annotation[self._pos_id]
+        form = annotation[self._form_id] or ''
+        return (self.partofspeech.code(pos), self.tags.code(pos+' '+form if form else pos))
+
+    def add_word(self, word_text, type_of_fix, outcome, a_anns, b_anns, aligned):
+        """Adds the word with its outcome (one of outcome_names) and the alignments of its annotations
+           as (status, a_id, b_id) triples of align_annotation_tuples."""
+        word = len(self.word_outcome)
+        self.word_location.append(self._location)
+        self.word_fix.append(self.fixes.code(type_of_fix or ''))
+        self.word_type.append(self.words.code(word_text))
+        self.word_outcome.append(self.outcome_names.index(outcome))
+        for status, a_id, b_id in aligned:
+            manual = self._codes(a_anns[a_id] if a_id is not None else None)
+            auto = self._codes(b_anns[b_id] if b_id is not None else None)
+            self.alignment_word.append(word)
+            self.alignment_status.append(self.status_names.index(status))
+            self.manual_partofspeech.append(manual[0])
+            self.manual_tag.append(manual[1])
+            self.auto_partofspeech.append(auto[0])
+            self.auto_tag.append(auto[1])
+
+    def merge(self, other):
+        """Adds the words and alignments of other, its codes are changed into the codes of this collector."""
+        numpy = import_numpy()
+        remapped = {name: numpy.array(getattr(self, name).remap(getattr(other, name)), dtype=numpy.intc) for name in self.category_names}
+        def extend(column, codes):
+            getattr(self, column).frombytes(codes.astype(numpy.intc).tobytes())
+        columns = other.arrays()
+        words_before = len(self.word_outcome)
+        for column, categories in (('word_location', 'locations'), ('word_fix', 'fixes'), ('word_type', 'words'),
+                                   ('manual_partofspeech', 'partofspeech'), ('auto_partofspeech', 'partofspeech'),
+                                   ('manual_tag', 'tags'), ('auto_tag', 'tags')):
+            extend(column, remapped[categories][columns[column]])
+        extend('word_outcome', columns['word_outcome'])
+        extend('alignment_status', columns['alignment_status'])
+        extend('alignment_word', columns['alignment_word']+words_before)
+
+    def arrays(self):
+        """The columns as NumPy arrays, they share the memory of the collector."""
+        numpy = import_numpy()
+        return {name: numpy.frombuffer(getattr(self, name), dtype=numpy.intc) for name in self.word_columns+self.alignment_columns}
+
+    @staticmethod
+    def _count_pairs(numpy, rows, columns, n_rows, n_columns):
+        return numpy.bincount(rows.astype(numpy.int64)*n_columns+columns, minlength=n_rows*n_columns).reshape(n_rows, n_columns)
+
+    def confusion_matrix(self, attribute='partofspeech'):
+        """The numbers of the alignments by the manual (rows) and the automatic (columns) value of
+           the attribute: 'partofspeech' or 'tags' (part of speech with form). The codes are the ones of the categories."""
+        numpy = import_numpy()
+        columns = self.arrays()
+        prefix = 'partofspeech' if attribute == 'partofspeech' else 'tag'
+        n = len(getattr(self, attribute))
+        return self._count_pairs(numpy, columns['manual_'+prefix], columns['auto_'+prefix], n, n)
+
+    def breakdown(self, by='locations'):
+        """The numbers of the words by the categories of by ('locations', 'fixes' or 'words') and by the outcome."""
+        numpy = import_numpy()
+        columns = self.arrays()
+        column = {'locations': 'word_location', 'fixes': 'word_fix', 'words': 'word_type'}[by]
+        return self._count_pairs(numpy, columns[column], columns['word_outcome'], len(getattr(self, by)), len(self.outcome_names))
+
+    def top_errors(self, k):
+        """The k word forms that are most often incorrectly or not automatically analyzed,
+           as (word, errors, occurrences) triples. Words with equal numbers of errors are in the order of their first occurrence."""
+        numpy = import_numpy()
+        by_word = self.breakdown('words')
+        errors = by_word[:, self.outcome_names.index('incorrectly_analyzed')]+by_word[:, self.outcome_names.index('not_automatically_analyzed')]
+        order = numpy.argsort(-errors, kind='stable')[:k]
+        order = order[errors[order] > 0]
+        return [(self.words.labels[i], int(errors[i]), int(by_word[i].sum())) for i in order]
+
+def write_error_report(errors, directory, top_words=100):
+    """Writes the error breakdowns into the directory: errors.npz with the collected arrays, their labels and
+       the confusion matrices, and the csv files confusion_partofspeech.csv (the matrix), confusions.csv (the
+       confusions of the parts of speech with forms from the most common), locations.csv, type_of_fix.csv
+       (the outcomes of the words) and error_words.csv (the most common incorrectly analyzed word forms)."""
+    numpy = import_numpy()
+    os.makedirs(directory, exist_ok=True)
+    pos_matrix = errors.confusion_matrix('partofspeech')
+    tag_matrix = errors.confusion_matrix('tags')
+    locations = errors.breakdown('locations')
+    fixes = errors.breakdown('fixes')
+    labels = {name+'_labels': numpy.array(getattr(errors, name).labels, dtype=str) for name in ErrorCollector.category_names}
+    numpy.savez_compressed(os.path.join(directory, 'errors.npz'), confusion_partofspeech=pos_matrix, confusion_tags=tag_matrix,
+        locations_breakdown=locations, fixes_breakdown=fixes, outcome_labels=numpy.array(ErrorCollector.outcome_names),
+        status_labels=numpy.array(ErrorCollector.status_names), **labels, **errors.arrays())
+    def write_rows(file_name, header, rows):
+        with open(os.path.join(directory, file_name), 'w', encoding='utf-8', newline='') as fout:
+            writer = csv.writer(fout)
+            writer.writerow(header)
+            writer.writerows(rows)
+    pos_labels = errors.partofspeech.labels
+    write_rows('confusion_partofspeech.csv', ['manual/automatic']+pos_labels,
+        ([label]+row.tolist() for label, row in zip(pos_labels, pos_matrix)))
+    # The confusions from the most common, the alignments with equal tags are left out
+    manual, auto = numpy.nonzero(tag_matrix)
+    counts = tag_matrix[manual, auto]
+    keep = manual != auto
+    manual, auto, counts = manual[keep], auto[keep], counts[keep]
+    order = numpy.lexsort((auto, manual, -counts))
+    tag_labels = errors.tags.labels
+    write_rows('confusions.csv', ['manual', 'automatic', 'count'],
+        ([tag_labels[manual[i]], tag_labels[auto[i]], int(counts[i])] for i in order))
+    for file_name, name, categories, table in (('locations.csv', 'location', errors.locations, locations),
+                                               ('type_of_fix.csv', 'type_of_fix', errors.fixes, fixes)):
+        write_rows(file_name, [name, 'words']+ErrorCollector.outcome_names,
+            ([label, int(row.sum())]+row.tolist() for label, row in zip(categories.labels, table)))
+    write_rows('error_words.csv', ['word', 'errors', 'occurrences'], errors.top_errors(top_words))
@@ -1,141 +1,171 @@
 #A script for evaluating automatic morphological analysis.
 #Takes the manually tagged corpus and compares it to the automatic morph analysis.
 #Author: Gerth Jaanimäe
+import os
 import sys
-if len(sys.argv) < 2:
-	sys.stderr.write("Error: You must specify the directory of the manually tagged files. Optionally you can also specify the directory for the user dictionaries.\nUsage: evaluate_automatic_morph_analysis.py <manually-tagged-files> <optional-user-dictionaries>\n")
-	sys.exit(1)
+import json
+import pickle
+import hashlib
+import argparse
+import multiprocessing
+arg_parser=argparse.ArgumentParser(description="Compares the automatic morphological analysis to the manually analyzed corpus.")
+arg_parser.add_argument("manually_tagged_files", help="the directory of the manually tagged files")
+arg_parser.add_argument("user_dictionaries", nargs="?", default="", help="the directory for the user dictionaries")
+arg_parser.add_argument("--tsv-cache", default=None, help="the directory for caching the parsed manually tagged files")
+arg_parser.add_argument("--workers", type=int, default=1, help="the number of processes evaluating the files (default: 1)")
+arg_parser.add_argument("--error-report", default=None, help="save the confusion matrices and the breakdowns of the errors into this directory (needs numpy)")
+arg_parser.add_argument("--top-error-words", type=int, default=100, help="the number of the most often incorrectly analyzed word forms in the error report (default: 100)")
+arg_parser.add_argument("--eval-cache", default=None, help="the directory for caching the evaluation results of the files, so that only the files affected by a change are evaluated again")
+args=arg_parser.parse_args()
 
 import corpus_readers
+import estnltk
 from estnltk import Layer, Text
 from estnltk.taggers import VabamorfAnalyzer
-from estnltk.taggers import DiffTagger
-from estnltk.layer_operations import flatten
 from estnltk.taggers.text_segmentation.whitespace_tokens_tagger import WhiteSpaceTokensTagger
 from estnltk.taggers.morph_analysis.morf_common import _is_empty_annotation
 from morph_pipeline import *
-manually_tagged=corpus_readers.read_from_tsv(sys.argv[1])
-if len(sys.argv) > 2:
-	user_dict_dir=sys.argv[2]
-else:
-	user_dict_dir=""
+manually_tagged=corpus_readers.read_from_tsv(args.manually_tagged_files, cache_dir=args.tsv_cache)
+user_dict_dir=args.user_dictionaries
+#The index of the user dictionaries is built once here, the pipelines (also the ones of the workers) only open it
+user_dict_index_file=build_user_dict_index(user_dict_dir)
 
-from morph_eval_utils import remove_attribs_from_layer
-from morph_eval_utils import get_estnltk_morph_analysis_diff_annotations
-from morph_eval_utils import get_estnltk_morph_analysis_annotation_alignments
-from morph_eval_utils import get_concise_morph_diff_alignment_str
+from morph_eval_utils import evaluate_morph_analysis
+from eval_metrics import EvalMetrics, ErrorCollector, write_error_report
 
 #vm_analyzer=VabamorfAnalyzer(guess=False, propername=False)
 #vm_analyzer=VabamorfAnalyzer()
 
-diff_tagger = DiffTagger(layer_a='manual_morph_flat',
-	layer_b='morph_analysis_flat',
-	output_layer='diff_layer',
-	output_attributes=('span_status', 'root', 'lemma', 'root_tokens', 'ending', 'clitic', 'partofspeech', 'form'),
-	span_status_attribute='span_status')
-morph_configuration={'add_punctuation_analysis':False, 'tokens_tagger':WhiteSpaceTokensTagger(), 'user_dictionaries':create_user_dict_taggers(user_dict_dir)}
-print ("filename\tprecision\trecall\tf-score\tpercentage of ambiguous words\taverage number of analyses per ambiguous word\ttotal words\ttotal with no punctuation\ttotal number of manually analyzed\tunambiguous\tunambiguous with no punctuation\tambiguous correctly analyzed\tambiguously analyzed total\tambiguous analyses total\tcorrectly analyzed\tincorrectly analyzed\tautomatically analyzed total\tnot automatically analyzed\tnot manually analyzed")
-whole_corpus=[0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0]
-for text in manually_tagged:
-	#print (text.meta['id'])
-	text=apply_pipeline(text, morph_configuration)
-	morph_analysis_proc=remove_attribs_from_layer(text, 'morph_analysis', 'morph_analysis_processed', ['normalized_text'])
-	manual_morph_proc=remove_attribs_from_layer(text, 'manual_morph', 'manual_morph_processed', ['normalized_text'])
-	text.add_layer(flatten(morph_analysis_proc, 'morph_analysis_flat'))
-	text.add_layer(flatten(manual_morph_proc, 'manual_morph_flat'))
-	diff_tagger.tag(text)
-	
-	# Get differences grouped by word spans
-	ann_diffs_grouped = get_estnltk_morph_analysis_diff_annotations( text, 'manual_morph_flat','morph_analysis_flat', 'diff_layer')
-	# Align annotation differences for each word: find common, modified, missing and extra annotations
-	focus_attributes=['root', 'partofspeech', 'form'] # which attributes will be displayed
-	diff_word_alignments = get_estnltk_morph_analysis_annotation_alignments( ann_diffs_grouped, ['manual_morph_flat','morph_analysis_flat'],focus_attributes=focus_attributes  )
-	# Display results word by word
-	
-	diff_index=0
-	unambiguous=0
-	ambiguous_correct=0
-	incorrectly_analyzed=0
-	not_automatically_analyzed=0
-	not_manually_analyzed=0
-	ambiguous_total=0
-	punct=0
-	total=0
-	ambiguous_analyses=0
-	for word_id, word in enumerate( text['manual_morph_flat'].spans ):
-		total+=1
-		#Check if a word is punctuation
-		if len(word.text) > 0 and not any([c.isalnum() for c in word.text]):
-			punct+=1
-		#Check if the loop is at the end of differences.
-		if diff_index==len(diff_word_alignments):
-			if word.annotations[0]['lemma']==None:
-				not_manually_analyzed+=1
-			else:
-				unambiguous+=1
-				#print (word.annotations)
-			continue
-		
-		alignments=diff_word_alignments[diff_index]
-		#If the word does not exist in the diff layer
-		if alignments['start'] != word.start and alignments['end'] != word.end:
-			if word.annotations[0]['lemma']==None:
-				not_manually_analyzed+=1
-			else:
-				unambiguous+=1
-			#print (word.annotations)
-			continue
-		if word.annotations[0]['lemma']==None:
-			not_manually_analyzed+=1
-		# Sanity check: at this point, words should be equal or skipped
-		assert word.text == alignments['text'], '(!) Mismatching words {!r} vs {!r}'.format(word.text, alignments['text'])
-		if word.annotations[0]['lemma']!=None:
-			statuses=[]
-			for alignment in alignments['alignments']:
-				statuses.append(alignment['__status'])
-			if len(statuses) > 1:
-				ambiguous_total+=1
-				ambiguous_analyses+=len(statuses)
-			if 'COMMON' in statuses:
-				ambiguous_correct += 1
-			elif 'MODIFIED' in statuses:
-				#print ("automatic: ", text['morph_analysis_flat'].spans[word_id])
-				#print ("manual: ", text['manual_morph_flat'].spans[word_id])
-				incorrectly_analyzed+=1
-			elif 'MISSING' in statuses:
-				not_automatically_analyzed+=1
-		diff_index+=1
-	unambiguous_no_punct=unambiguous - punct
-	correctly_analyzed=unambiguous_no_punct + ambiguous_correct
-	total_no_punct=total - punct
-	total_manually_analyzed=total_no_punct - not_manually_analyzed
-	analyzed=total_no_punct - not_automatically_analyzed -not_manually_analyzed
-	# Check: count auto analysed also separately
-	analyzed_count=0
-	for index, word in enumerate(text['morph_analysis'].spans):
-		if not (len(word.text) > 0 and not any([c.isalnum() for c in word.text])):
-			if word.annotations[0]['lemma']!=None and text['manual_morph_flat'].spans[index].annotations[0]['lemma']!=None:
-				analyzed_count+=1
-	#print (analyzed_count, analyzed)
-	assert 0 <= analyzed_count - analyzed <= 2  # TODO: resolve this anomaly in future
-	precision=correctly_analyzed /analyzed
-	recall=correctly_analyzed/total_manually_analyzed
-	f_score=(2 * precision * recall) / (precision + recall)
-	ambiguous_percentage=ambiguous_total/total*100
-	average_analyses=ambiguous_analyses/ambiguous_total
-	row=[precision, recall, f_score, ambiguous_percentage, average_analyses, total, total_no_punct, total_manually_analyzed, unambiguous, unambiguous_no_punct, ambiguous_correct, ambiguous_total, ambiguous_analyses, correctly_analyzed, incorrectly_analyzed, analyzed, not_automatically_analyzed, not_manually_analyzed]
-	#convert the elements into strings and also add them to the whole corpus results
-	for index, i in enumerate(row):
-		whole_corpus[index]+=i
-		row[index]=str(round(i, 2))
-	print ("\t".join([text.meta['id']] + row))
-#To get the average precision, recall and f-score, divide the previously added sums with the number of texts.
-whole_corpus[0]=whole_corpus[0]/len(manually_tagged)
-whole_corpus[1]=whole_corpus[1]/len(manually_tagged)
-whole_corpus[2]=whole_corpus[2]/len(manually_tagged)
-whole_corpus[3]=whole_corpus[3]/len(manually_tagged)
-whole_corpus[4]=whole_corpus[4]/len(manually_tagged)
-for index, i in enumerate(whole_corpus):
-	whole_corpus[index]=str(round(i, 2))
-print ("\t".join(['Whole corpus'] + whole_corpus))
-	
\ No newline at end of file
+focus_attributes=['root', 'partofspeech', 'form']
+#The settings of the automatic analysis, they are a part of the keys of the cached results
+pipeline_settings={'prenormalize':True, 'normalize':False, 'add_punctuation_analyses':True, 'guess':False, 'propername':False, 'tokens_tagger':'whitespace'}
+
+def create_morph_pipeline():
+	return MorphPipeline({'prenormalize':pipeline_settings['prenormalize'], 'normalize':pipeline_settings['normalize'],
+		'add_punctuation_analyses':pipeline_settings['add_punctuation_analyses'],
+		'vm_analyzer':VabamorfAnalyzer(guess=pipeline_settings['guess'], propername=pipeline_settings['propername']),
+		'tokens_tagger':WhiteSpaceTokensTagger(), 'user_dictionaries':open_user_dict_index(user_dict_index_file)})
+
+class EvalCache:
+    """The evaluation results of the files, cached by the contents of the file, the settings of the analysis,
+       the global and location user dictionaries and the code of the evaluation. So after changing a dictionary
+       only the files of its location are evaluated again, and the whole corpus is summed up from the cached
+       results of the rest."""
+    version = '1'
+    #The modules whose code makes the results, a change in any of them (or in this script) invalidates the cache
+    code_modules = ['corpus_readers', 'morph_pipeline', 'morph_eval_utils', 'eval_metrics']
+
+    def __init__(self, cache_dir, user_dict_dir):
+        self.cache_dir = cache_dir
+        self.user_dict_dir = user_dict_dir
+        self._dictionary_hashes = {}
+        self.code_hash = self._code_hash()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _code_hash(self):
+        code_hash = hashlib.sha256()
+        for code_file in [__file__]+[sys.modules[name].__file__ for name in self.code_modules]:
+            with open(code_file, 'rb') as fin:
+                code_hash.update(hashlib.sha256(fin.read()).digest())
+        return code_hash.hexdigest()
+
+    def _dictionary_hash(self, name):
+        if name not in self._dictionary_hashes:
+            dict_file = os.path.join(self.user_dict_dir, name+'.tsv')
+            if self.user_dict_dir == '' or not os.path.isfile(dict_file):
+                self._dictionary_hashes[name] = ''
+            else:
+                self._dictionary_hashes[name] = user_dict_fingerprint(dict_file)
+        return self._dictionary_hashes[name]
+
+    def key(self, text):
+        settings = [self.version, getattr(estnltk, '__version__', ''), self.code_hash, text.meta['tsv_hash'], pipeline_settings, focus_attributes,
+                    self._dictionary_hash('global'), self._dictionary_hash(text.meta['location'])]
+        return hashlib.sha256(json.dumps(settings, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def load(self, key, with_errors):
+        """Returns the cached metrics and errors, or None, if the file has to be evaluated.
+           The results cached without the errors are not used, if the errors are needed."""
+        cache_file = os.path.join(self.cache_dir, key+'.pickle')
+        if not os.path.exists(cache_file):
+            return None
+        with open(cache_file, 'rb') as fin:
+            (metrics, errors) = pickle.load(fin)
+        if with_errors and errors is None:
+            return None
+        return (metrics, errors)
+
+    def store(self, key, result):
+        cache_file = os.path.join(self.cache_dir, key+'.pickle')
+        with open(cache_file+'.tmp', 'wb') as fout:
+            pickle.dump(result, fout, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(cache_file+'.tmp', cache_file)
+
+#The pipeline of a worker process, it is created once per process
+worker_morph_pipeline=None
+
+def init_worker():
+	global worker_morph_pipeline
+	worker_morph_pipeline=create_morph_pipeline()
+
+#Analyses the text with the given index in manually_tagged and compares the analysis to the manual one.
+#The workers are forked after reading the files, so only the index is sent to them and the metrics are sent back,
+#with the errors of the file if they are collected for the error report.
+def evaluate_file(index, morph_pipeline=None):
+	if morph_pipeline is None:
+		morph_pipeline=worker_morph_pipeline
+	text=morph_pipeline.process(manually_tagged[index])
+	# Compare the analyses word by word: find common, modified, missing and extra annotations
+	errors=ErrorCollector() if args.error_report else None
+	counts=evaluate_morph_analysis(text, 'manual_morph', 'morph_analysis', focus_attributes=focus_attributes, errors=errors)
+	return (EvalMetrics(text.meta['id'], counts), errors)
+
+#Look up the cached results, only the rest of the files are evaluated
+cached_results=[None]*len(manually_tagged)
+if args.eval_cache:
+	eval_cache=EvalCache(args.eval_cache, user_dict_dir)
+	cache_keys=[eval_cache.key(text) for text in manually_tagged]
+	cached_results=[eval_cache.load(key, args.error_report is not None) for key in cache_keys]
+evaluated_indexes=[index for index, result in enumerate(cached_results) if result is None]
+
+#The results of all the files in their order, the evaluated ones are stored in the cache
+def file_results(evaluated_results):
+	for index, result in enumerate(cached_results):
+		if result is None:
+			result=next(evaluated_results)
+			if args.eval_cache:
+				eval_cache.store(cache_keys[index], result)
+		yield result
+
+print ("\t".join(['filename']+EvalMetrics.column_titles))
+whole_corpus=EvalMetrics()
+corpus_errors=ErrorCollector() if args.error_report else None
+if args.workers > 1 and evaluated_indexes:
+	pool=multiprocessing.get_context('fork').Pool(min(args.workers, len(evaluated_indexes)), initializer=init_worker)
+	file_metrics=file_results(pool.imap(evaluate_file, evaluated_indexes))
+else:
+	pool=None
+	morph_pipeline=create_morph_pipeline() if evaluated_indexes else None
+	file_metrics=file_results(evaluate_file(index, morph_pipeline) for index in evaluated_indexes)
+#The metrics come in the order of the files, so the results are the same with any number of workers
+for (metrics, errors) in file_metrics:
+	metrics.check()
+	print (metrics.format_row(metrics.file_id))
+	whole_corpus.merge(metrics)
+	if corpus_errors is not None:
+		corpus_errors.merge(errors)
+if pool is not None:
+	pool.close()
+	pool.join()
+if args.eval_cache:
+	sys.stderr.write("Evaluated "+str(len(evaluated_indexes))+" files, "+str(len(manually_tagged)-len(evaluated_indexes))+" results from the cache.\n")
+#Every word of every file is counted once, also the ones of the cached results
+assert whole_corpus.files == len(manually_tagged)
+assert whole_corpus.total == sum(len(text['manual_morph']) for text in manually_tagged)
+whole_corpus.check()
+#The macro-averages of precision, recall and f-score are the averages of the files,
+#the micro-averages are calculated from the counts of all the words.
+print (whole_corpus.format_row('Whole corpus', average='macro'))
+print (whole_corpus.format_row('Whole corpus (micro-average)', average='micro'))
+if corpus_errors is not None:
+	write_error_report(corpus_errors, args.error_report, args.top_error_words)
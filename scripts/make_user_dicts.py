@@ -1,9 +1,13 @@
 #Makes the user dictionaries from manually annotated corpus and specified words with their normalized forms.
 #author: Gerth Jaanimäe
 import sys
-if len(sys.argv) < 2:
-	sys.stderr.write("Error: You must specify at least the output directory for the user dictionaries and input for the manually annotated files. You can also add the directory containing files with non-standard and normalized forms.\nUsage: make_user_dictionaries.py <output-directory> <input-directory-with-manual-annotations> <optional-normalized-words>\n")
-	sys.exit(1)
+import argparse
+arg_parser=argparse.ArgumentParser(description="Makes the user dictionaries from manually annotated corpus and specified words with their normalized forms.")
+arg_parser.add_argument("output_directory", help="the output directory for the user dictionaries")
+arg_parser.add_argument("manual_annotations", help="the directory with the manually annotated files")
+arg_parser.add_argument("normalized_words", nargs="?", default="", help="the directory containing files with non-standard and normalized forms")
+arg_parser.add_argument("--tsv-cache", default=None, help="the directory for caching the parsed manually annotated files")
+args=arg_parser.parse_args()
 
 import corpus_readers
 from estnltk import Layer, Text
@@ -19,12 +23,9 @@ import csv
 import operator
 
 
-manually_tagged=corpus_readers.read_from_tsv(sys.argv[2])
-user_dict_dir=sys.argv[1]
-if len(sys.argv) == 4:
-	normalized_words_dir=sys.argv[3]
-else:
-	normalized_words_dir=""
+manually_tagged=corpus_readers.read_from_tsv(args.manual_annotations, cache_dir=args.tsv_cache)
+user_dict_dir=args.output_directory
+normalized_words_dir=args.normalized_words
 if not os.path.exists(user_dict_dir):
 	os.mkdir(user_dict_dir)
 
@@ -40,12 +41,12 @@ diff_tagger = DiffTagger(layer_a='manual_morph_flat',
 	output_attributes=('span_status', 'root', 'lemma', 'root_tokens', 'ending', 'clitic', 'partofspeech', 'form'),
 	span_status_attribute='span_status')
 dicts={}
-morph_configuration={'add_punctuation_analysis':True, 'tokens_tagger':WhiteSpaceTokensTagger()}
+morph_pipeline=MorphPipeline({'add_punctuation_analyses':True, 'tokens_tagger':WhiteSpaceTokensTagger()})
 for text in manually_tagged:
 	#print (text.meta['id'])
 	if text.meta['location'] not in dicts:
 		dicts[text.meta['location']]=[]
-	text=apply_pipeline(text, morph_configuration)
+	text=morph_pipeline.process(text)
 	morph_analysis_proc=remove_attribs_from_layer(text, 'morph_analysis', 'morph_analysis_processed', ['normalized_text'])
 	manual_morph_proc=remove_attribs_from_layer(text, 'manual_morph', 'manual_morph_processed', ['normalized_text'])
 	text.add_layer(flatten(morph_analysis_proc, 'morph_analysis_flat'))
@@ -0,0 +1,21 @@
+#!/usr/bin/python3
+#Merges the json statistics reports of annotate_corpus.py from several runs or shards of the corpus.
+#The merged statistics are saved as a json report and/or as csv files.
+import sys
+import argparse
+arg_parser=argparse.ArgumentParser(description="Merges the json statistics reports of annotate_corpus.py.")
+arg_parser.add_argument("reports", nargs="+", help="the json reports to merge")
+arg_parser.add_argument("--stats-json", default=None, help="save the merged statistics as a json report into this file")
+arg_parser.add_argument("--stats-csv", default=None, help="save the merged statistics as csv files into this directory")
+args=arg_parser.parse_args()
+if not args.stats_json and not args.stats_csv:
+	arg_parser.error("give --stats-json and/or --stats-csv for the merged statistics")
+
+from corpus_stats import merge_reports, write_json_report, write_csv_report
+
+stats=merge_reports(args.reports)
+if args.stats_json:
+	write_json_report(stats, args.stats_json)
+if args.stats_csv:
+	write_csv_report(stats, args.stats_csv)
+sys.stderr.write("Merged "+str(len(args.reports))+" reports of "+str(stats.runs)+" runs, "+str(len(stats.locations))+" locations.\n")
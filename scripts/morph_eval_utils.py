@@ -15,6 +15,7 @@ from estnltk.taggers.standard_taggers.diff_tagger import iterate_diff_conflicts
 from estnltk.taggers.standard_taggers.diff_tagger import iterate_modified
 
 from collections import defaultdict
+from operator import eq, itemgetter
 
 
 def remove_attribs_from_layer(text, layer_name, new_layer_name, remove_attribs):
@@ -34,9 +35,82 @@ def remove_attribs_from_layer(text, layer_name, new_layer_name, remove_attribs):
     return new_layer
 
 
-def get_estnltk_morph_analysis_diff_annotations( text_obj, layer_a, layer_b, diff_layer ):
+# Words with more pairs of annotations than this are matched by hashing the annotations,
+# for the fewer pairs of the usual words the direct comparison of the dicts is faster
+HASHED_MATCHING_MIN_PAIRS = 64
+
+
+def _hashable_attributes( annotation, attributes ):
+    ''' Returns the attributes that have hashable values in the annotation dict. '''
+    hashable = []
+    for attr in attributes:
+        try:
+            hash(annotation[attr])
+        except TypeError:
+            continue
+        hashable.append(attr)
+    return hashable
+
+
+def _hash_buckets( annotations, signature ):
+    ''' Groups the indexes of the annotation dicts by their signatures (the tuples of the values of the 
+        hashable attributes given by signature), so that equal annotations are in the same bucket. 
+        Returns None if some annotation has no hashable signature.
+    '''
+    buckets = {}
+    try:
+        for anno_id, anno in enumerate(annotations):
+            buckets.setdefault(signature(anno), []).append(anno_id)
+    except (TypeError, KeyError):
+        return None
+    return buckets
+
+
+def _find_in_buckets( anno, annotations, buckets, signature ):
+    ''' Returns the index of the first annotation in annotations that is equal to anno, or None. 
+        Uses the buckets of _hash_buckets, if they are given. 
+    '''
+    candidates = range(len(annotations))
+    if buckets is not None:
+        try:
+            candidates = buckets.get(signature(anno), [])
+        except (TypeError, KeyError):
+            pass
+    for anno_id in candidates:
+        if anno == annotations[anno_id]:
+            return anno_id
+    return None
+
+
+def _best_partial_match( a, b_anns, skip, focus_ids ):
+    ''' Finds the annotation tuple in b_anns that has the most values matching with the tuple a (at least one). 
+        A later annotation with more matching values is taken only if it has at least as many matching 
+        values in the focus positions focus_ids as the one found before. Annotations whose indexes are in 
+        skip are passed over. Returns the index of the annotation or None.
+    '''
+    closest_b_id = None
+    closest_matching = 0
+    closest_focus = 0
+    for b_id, b in enumerate(b_anns):
+        if b_id in skip:
+            continue
+        matching = sum(map(eq, a, b))
+        if matching > closest_matching:
+            focus = len([i for i in focus_ids if a[i] == b[i]])
+            if closest_b_id is None or focus >= closest_focus:
+                closest_b_id = b_id
+                closest_matching = matching
+                closest_focus = focus
+    return closest_b_id
+
+
+def get_estnltk_morph_analysis_diff_annotations( text_obj, layer_a, layer_b, diff_layer, sanity_check=True ):
     ''' Collects differing sets of annotations from EstNLTK's morph_analysis diff_layer. 
         Groups differences by word spans. Returns a list of dicts.
+        The annotations of highly ambiguous words are matched by the hashed tuples of their values, 
+        the result is the same as with comparing all the pairs of annotations. 
+        With sanity_check=False, the numbers of missing and extra annotations are not checked 
+        against the diff_layer.
     '''
     STATUS_ATTR = '__status'
     assert isinstance(text_obj, Text)
@@ -50,24 +124,35 @@ def get_estnltk_morph_analysis_diff_annotations( text_obj, layer_a, layer_b, dif
     assert STATUS_ATTR not in common_attribs, "(!) Unexpected attribute {!r} in {!r}.".format(STATUS_ATTR, common_attribs)
     assert layer_a not in ['start', 'end']
     assert layer_b not in ['start', 'end']
+    signature = None
+    def collect_annotations( span ):
+        # The annotations as dicts of the common attributes (in their order in the annotation)
+        annotations = []
+        for anno in span.annotations:
+            anno_dict = {attr:value for attr, value in anno.__dict__.items() if attr in common_attribs}
+            anno_dict[STATUS_ATTR] = None
+            annotations.append( anno_dict )
+        return annotations
     collected_diffs = []
     missing_annotations = 0
     extra_annotations   = 0
     a_id = 0
     b_id = 0
+    layer_a_len = len(layer_a_spans)
+    layer_b_len = len(layer_b_spans)
     for diff_span in iterate_modified( text_obj[diff_layer], 'span_status' ):
         ds_start = diff_span.start
         ds_end =   diff_span.end
         # Find corresponding span in both layer
         a_span = None
         b_span = None
-        while a_id < len(layer_a_spans):
+        while a_id < layer_a_len:
             cur_a_span = layer_a_spans[a_id]
             if cur_a_span.start == ds_start and cur_a_span.end == ds_end:
                 a_span = cur_a_span
                 break
             a_id += 1
-        while b_id < len(layer_b_spans):
+        while b_id < layer_b_len:
             cur_b_span = layer_b_spans[b_id]
             if cur_b_span.start == ds_start and cur_b_span.end == ds_end:
                 b_span = cur_b_span
@@ -77,34 +162,30 @@ def get_estnltk_morph_analysis_diff_annotations( text_obj, layer_a, layer_b, dif
             raise Exception('(!) {!r} not found from layer {!r}'.format(diff_span, layer_a))
         if b_span == None:
             raise Exception('(!) {!r} not found from layer {!r}'.format(diff_span, layer_b))
-        a_annotations = []
-        for a_anno in a_span.annotations:
-            a_dict = a_anno.__dict__.copy()
-            a_dict = {a:a_dict[a] for a in a_dict.keys() if a in common_attribs}
-            a_dict[STATUS_ATTR] = None
-            a_annotations.append( a_dict )
-        b_annotations = []
-        for b_anno in b_span.annotations:
-            b_dict = b_anno.__dict__.copy()
-            b_dict = {b:b_dict[b] for b in b_dict.keys() if b in common_attribs}
-            b_dict[STATUS_ATTR] = None
-            b_annotations.append( b_dict )
+        a_annotations = collect_annotations( a_span )
+        b_annotations = collect_annotations( b_span )
+        # Each annotation of a is common with the first equal annotation of b that is not common yet 
+        # (the statuses are compared too). The annotations of highly ambiguous words are hashed.
+        b_buckets = None
+        if len(a_annotations)*len(b_annotations) > HASHED_MATCHING_MIN_PAIRS:
+            if signature is None:
+                signature = itemgetter( *(_hashable_attributes(a_annotations[0], a_annotations[0].keys()) or [STATUS_ATTR]) )
+            b_buckets = _hash_buckets( b_annotations, signature )
         for a_anno in a_annotations:
-            match_found = False
-            for b_anno in b_annotations:
-                if a_anno == b_anno:
-                    a_anno[STATUS_ATTR] = 'COMMON'
-                    b_anno[STATUS_ATTR] = 'COMMON'
-                    match_found = True
-                    break
-            if not match_found:
+            b_anno_id = _find_in_buckets( a_anno, b_annotations, b_buckets, signature )
+            if b_anno_id is not None:
+                a_anno[STATUS_ATTR] = 'COMMON'
+                b_annotations[b_anno_id][STATUS_ATTR] = 'COMMON'
+            else:
                 missing_annotations += 1
                 a_anno[STATUS_ATTR] = 'MISSING'
         for b_anno in b_annotations:
-            if b_anno not in a_annotations:
+            if b_anno[STATUS_ATTR] is None:
                 extra_annotations += 1
                 b_anno[STATUS_ATTR] = 'EXTRA'
         collected_diffs.append( {'text':diff_span.text, layer_a: a_annotations, layer_b: b_annotations, 'start':diff_span.start, 'end':diff_span.end} )
+    if not sanity_check:
+        return collected_diffs
     # Sanity check: missing vs extra annotations:
     # Note: text_obj[diff_layer].meta contains more *_annotations items, because it also 
     #       counts annotations in missing spans and extra spans; Unfortunately, merely
@@ -134,10 +215,14 @@ def get_estnltk_morph_analysis_diff_annotations( text_obj, layer_a, layer_b, dif
     return collected_diffs
 
 
-def get_estnltk_morph_analysis_annotation_alignments( collected_diffs, layer_names, focus_attributes=['root','partofspeech', 'form'], remove_status=True ):
+def get_estnltk_morph_analysis_annotation_alignments( collected_diffs, layer_names, focus_attributes=['root','partofspeech', 'form'], remove_status=True, sanity_check=True ):
     ''' Calculates annotation alignments between annotations in collected_diffs. 
         For each word span, determines common, modified, extra and missing annotations.
         Returns a list of alignment dicts.
+        The fully matching annotations of highly ambiguous words are found by the hashed tuples 
+        of their values and the partially matching ones by scoring the tuples of their values, 
+        the result is the same as with comparing the attributes of all the pairs of annotations. 
+        With sanity_check=False, the numbers of the aligned annotations are not checked.
     '''
     assert isinstance(layer_names, list) and len(layer_names) == 2
     STATUS_ATTR = '__status'
@@ -154,6 +239,12 @@ def get_estnltk_morph_analysis_annotation_alignments( collected_diffs, layer_nam
                 assert key in layer_names
         assert len( all_attributes ) > 0
         assert len([a for a in focus_attributes if a in all_attributes]) == len(focus_attributes)
+        focus_ids = [ i for i, attr in enumerate(all_attributes) if attr in focus_attributes ]
+        get_values = itemgetter( *all_attributes ) if len(all_attributes) > 1 else (lambda annotation: (annotation[all_attributes[0]],))
+        signature = None
+        def attribute_lists( a_values, b_values ):
+            matches = list(map(eq, a_values, b_values))
+            return [attr for attr, match in zip(all_attributes, matches) if match], [attr for attr, match in zip(all_attributes, matches) if not match]
         for word_diff in collected_diffs:
             alignment = word_diff.copy()
             a_anns = word_diff[layer_names[0]]
@@ -163,66 +254,44 @@ def get_estnltk_morph_analysis_annotation_alignments( collected_diffs, layer_nam
             alignment['alignments'] = []
             del alignment[layer_names[0]]
             del alignment[layer_names[1]]
-            a_used = set()
+            # The fully matching annotations are found by hashing, if there are many pairs of annotations
+            b_buckets = None
+            if len(a_anns)*len(b_anns) > HASHED_MATCHING_MIN_PAIRS:
+                if signature is None:
+                    signature = itemgetter( *(_hashable_attributes(a_anns[0], all_attributes)+[STATUS_ATTR]) )
+                b_buckets = _hash_buckets( b_anns, signature )
+            # The values of the attributes of b for finding the partially matching annotations
+            b_values = None
             b_used = set()
             for a_id, a in enumerate(a_anns):
                 # Find fully matching annotation
-                for b_id, b in enumerate(b_anns):
-                    if a == b:
-                        al = {STATUS_ATTR:'COMMON', layer_names[0]:a, layer_names[1]:b }
-                        al[MISMATCHING_ATTR] = []
-                        al[MATCHING_ATTR] = all_attributes.copy()
-                        alignment['alignments'].append( al )
-                        a_used.add(a_id)
-                        b_used.add(b_id)
-                        break
-                if a_id in a_used:
+                b_id = _find_in_buckets( a, b_anns, b_buckets, signature )
+                if b_id is not None:
+                    al = {STATUS_ATTR:'COMMON', layer_names[0]:a, layer_names[1]:b_anns[b_id] }
+                    al[MISMATCHING_ATTR] = []
+                    al[MATCHING_ATTR] = all_attributes.copy()
+                    alignment['alignments'].append( al )
+                    b_used.add(b_id)
                     continue
                 # Find partially matching annotation
-                closest_b = None
-                closest_b_id = None
-                closest_common   = []
-                closest_uncommon = []
-                for b_id, b in enumerate(b_anns):
-                    if a_id in a_used or b_id in b_used:
-                        continue
-                    if b[STATUS_ATTR] == 'COMMON':
-                        # Skip b that has been previously found as being common
-                        continue
-                    if a != b:
-                        #count common attribs
-                        matching_attribs = []
-                        mismatching = []
-                        for attr in all_attributes:
-                            if a[attr] == b[attr]:
-                                matching_attribs.append(attr)
-                            else:
-                                mismatching.append(attr)
-                        if len(matching_attribs) > len(closest_common):
-                            focus_1 = []
-                            focus_2 = []
-                            if closest_b != None:
-                                focus_1 = [a for a in focus_attributes if a in matching_attribs]
-                                focus_2 = [a for a in focus_attributes if a in closest_common]
-                            # in case of a tie, prefer matches with more focus attributes
-                            if len(focus_1) == len(focus_2) or len(focus_1) > len(focus_2):
-                                closest_common   = matching_attribs
-                                closest_uncommon = mismatching
-                                closest_b_id = b_id
-                                closest_b = b
-                if closest_b != None:
-                    al = {STATUS_ATTR:'MODIFIED', layer_names[0]:a, layer_names[1]:closest_b }
+                if b_values is None:
+                    b_values = [get_values(b) for b in b_anns]
+                    # Annotations of b that cannot be partially matching: the ones found as being common
+                    b_skip = { b_id for b_id, b in enumerate(b_anns) if b[STATUS_ATTR] == 'COMMON' }
+                a_values = get_values(a)
+                closest_b_id = _best_partial_match( a_values, b_values, b_used | b_skip, focus_ids )
+                if closest_b_id is not None:
+                    closest_common, closest_uncommon = attribute_lists( a_values, b_values[closest_b_id] )
+                    al = {STATUS_ATTR:'MODIFIED', layer_names[0]:a, layer_names[1]:b_anns[closest_b_id] }
                     al[MISMATCHING_ATTR] = closest_uncommon
                     al[MATCHING_ATTR] = closest_common
                     alignment['alignments'].append( al )
-                    a_used.add(a_id)
                     b_used.add(closest_b_id)
                 else:
                     al = {STATUS_ATTR:'MISSING', layer_names[0]:a, layer_names[1]:{} }
                     al[MISMATCHING_ATTR] = all_attributes.copy()
                     al[MATCHING_ATTR] = []
                     alignment['alignments'].append( al )
-                    a_used.add(a_id)
             for b_id, b in enumerate(b_anns):
                 if b_id not in b_used:
                     al = {STATUS_ATTR:'EXTRA', layer_names[0]:{}, layer_names[1]:b }
@@ -230,25 +299,26 @@ def get_estnltk_morph_analysis_annotation_alignments( collected_diffs, layer_nam
                     al[MATCHING_ATTR] = []
                     alignment['alignments'].append( al )
             alignments.append( alignment )
-    # Sanity check: check that we haven't lost any annotations during the careful alignment
-    annotations_by_layer_2 = defaultdict(int)
-    for word_diff in alignments:
-        for al in word_diff['alignments']:
-            for layer in layer_names:
-                if len(al[layer].keys()) > 0:
-                    annotations_by_layer_2[layer] += 1
-    for layer in layer_names:
-        if annotations_by_layer[layer] != annotations_by_layer_2[layer]:
-           # Output information about the context of the failure
-            from pprint import pprint
-            print('='*50)
-            print(layer,'  ',annotations_by_layer[layer], '  ', annotations_by_layer_2[layer])
-            print('='*50)
-            pprint(collected_diffs)
-            print('='*50)
-            pprint(alignments)
-            print('='*50)
-        assert annotations_by_layer[layer] == annotations_by_layer_2[layer], '(!) Failure in annotation conversion.'
+    if sanity_check:
+        # Sanity check: check that we haven't lost any annotations during the careful alignment
+        annotations_by_layer_2 = defaultdict(int)
+        for word_diff in alignments:
+            for al in word_diff['alignments']:
+                for layer in layer_names:
+                    if len(al[layer].keys()) > 0:
+                        annotations_by_layer_2[layer] += 1
+        for layer in layer_names:
+            if annotations_by_layer[layer] != annotations_by_layer_2[layer]:
+               # Output information about the context of the failure
+                from pprint import pprint
+                print('='*50)
+                print(layer,'  ',annotations_by_layer[layer], '  ', annotations_by_layer_2[layer])
+                print('='*50)
+                pprint(collected_diffs)
+                print('='*50)
+                pprint(alignments)
+                print('='*50)
+            assert annotations_by_layer[layer] == annotations_by_layer_2[layer], '(!) Failure in annotation conversion.'
     # Remove STATUS_ATTR's from annotations dict's (if required)
     if remove_status:
         for word_diff in alignments:
@@ -307,3 +377,125 @@ def get_concise_morph_diff_alignment_str( alignments, layer_a, layer_b, focus_at
             raise Exception( '(!) unexpected __status: {!r}'.format(alignment[STATUS_ATTR]) )
     return '\n'.join( out_str ) if not return_list else out_str
 
+
+
+def get_annotation_tuples( span, attributes ):
+    ''' Returns the annotations of the span as tuples of the values of the given attributes. 
+        Duplicate tuples are dropped (as in a flattened layer) and lists are converted to tuples, 
+        so that the tuples can be hashed.
+    '''
+    tuples = []
+    for annotation in span.annotations:
+        values = tuple( tuple(value) if isinstance(value, list) else value for value in (annotation[attr] for attr in attributes) )
+        if values not in tuples:
+            tuples.append( values )
+    return tuples
+
+
+def align_annotation_tuples( a_anns, b_anns, focus_ids ):
+    ''' Aligns the annotation tuples of one word in the same way as 
+        get_estnltk_morph_analysis_annotation_alignments aligns the annotations of a diff: 
+        fully matching annotations are COMMON, an annotation of a is MODIFIED with the unused 
+        annotation of b that has the most matching attributes (in case of a tie, the one with 
+        more focus attributes) and MISSING if there is none, the unused annotations of b are EXTRA. 
+        focus_ids are the positions of the focus attributes in the tuples.
+        Returns a list of (status, a_id, b_id) triples, a_id or b_id is None for EXTRA and MISSING.
+    '''
+    b_ids = { b:b_id for b_id, b in enumerate(b_anns) }
+    a_set = set(a_anns)
+    # The annotations of b that are common with some annotation of a are not partially matching
+    b_common = { b_id for b_id, b in enumerate(b_anns) if b in a_set }
+    b_used = set()
+    aligned = []
+    for a_id, a in enumerate(a_anns):
+        b_id = b_ids.get(a)
+        if b_id is not None:
+            aligned.append( ('COMMON', a_id, b_id) )
+            b_used.add(b_id)
+            continue
+        closest_b_id = _best_partial_match( a, b_anns, b_used | b_common, focus_ids )
+        if closest_b_id is not None:
+            aligned.append( ('MODIFIED', a_id, closest_b_id) )
+            b_used.add(closest_b_id)
+        else:
+            aligned.append( ('MISSING', a_id, None) )
+    for b_id in range(len(b_anns)):
+        if b_id not in b_used:
+            aligned.append( ('EXTRA', None, b_id) )
+    return aligned
+
+
+def evaluate_morph_analysis( text_obj, manual_layer='manual_morph', auto_layer='morph_analysis', focus_attributes=['root','partofspeech', 'form'], ignore_attributes=['normalized_text'], errors=None, fix_layer='type_of_fix' ):
+    ''' Compares the automatic morphological analysis to the manual one in a single pass over 
+        the word spans of both layers, without building any intermediate layers. 
+        The annotations are compared as tuples of the common attributes of the layers (except 
+        ignore_attributes), words with differing annotations are aligned like in 
+        get_estnltk_morph_analysis_annotation_alignments.
+        Punctuation is counted in total, punct, unambiguous and in the ambiguity counts, 
+        other counts are of the words that are not punctuation. 
+        If errors (an ErrorCollector of eval_metrics) is given, the outcomes and alignments of the 
+        words that are not punctuation and are manually analyzed are added to it, with the 
+        type_of_fix from fix_layer (if the text has it). 
+        Returns a dict of the counts.
+    '''
+    assert manual_layer in text_obj.layers, '(!) Layer {!r} missing from: {!r}'.format(manual_layer, text_obj.layers.keys())
+    assert auto_layer in text_obj.layers, '(!) Layer {!r} missing from: {!r}'.format(auto_layer, text_obj.layers.keys())
+    manual_spans = text_obj[manual_layer]
+    auto_spans = text_obj[auto_layer]
+    auto_attributes = set(auto_spans.attributes)
+    attributes = [a for a in manual_spans.attributes if a in auto_attributes and a not in ignore_attributes]
+    assert len([a for a in focus_attributes if a in attributes]) == len(focus_attributes)
+    focus_ids = [ attributes.index(a) for a in focus_attributes ]
+    lemma_id = attributes.index('lemma')
+    if len(manual_spans) != len(auto_spans):
+        raise Exception('(!) Mismatching numbers of words in layers {!r} and {!r}: {} vs {}'.format(manual_layer, auto_layer, len(manual_spans), len(auto_spans)))
+    counts = { 'total':0, 'punct':0, 'unambiguous':0, 'unambiguous_no_punct':0, 'ambiguous_correct':0, 
+               'ambiguous_total':0, 'ambiguous_analyses':0, 'incorrectly_analyzed':0, 'analyzed':0, 
+               'not_automatically_analyzed':0, 'not_manually_analyzed':0 }
+    fixes = [None]*len(manual_spans)
+    if errors is not None:
+        errors.start_text(text_obj.meta.get('location', ''), attributes)
+        if fix_layer in text_obj.layers:
+            fix_attribute = text_obj[fix_layer].attributes[0]
+            fixes = [span.annotations[0][fix_attribute] for span in text_obj[fix_layer]]
+    for manual_span, auto_span, type_of_fix in zip(manual_spans, auto_spans, fixes):
+        if manual_span.base_span != auto_span.base_span:
+            raise Exception('(!) {!r} not found from layer {!r}'.format(manual_span, auto_layer))
+        word_text = manual_span.text
+        is_punct = len(word_text) > 0 and not any([c.isalnum() for c in word_text])
+        counts['total'] += 1
+        if is_punct:
+            counts['punct'] += 1
+        a_anns = get_annotation_tuples(manual_span, attributes)
+        if a_anns[0][lemma_id] is None:
+            if not is_punct:
+                counts['not_manually_analyzed'] += 1
+            continue
+        b_anns = get_annotation_tuples(auto_span, attributes)
+        auto_analyzed = b_anns[0][lemma_id] is not None
+        if set(a_anns) == set(b_anns):
+            counts['unambiguous'] += 1
+            if not is_punct:
+                counts['unambiguous_no_punct'] += 1
+                counts['analyzed'] += 1
+                if errors is not None:
+                    errors.add_word(word_text, type_of_fix, 'unambiguous', a_anns, a_anns, [('COMMON', i, i) for i in range(len(a_anns))])
+            continue
+        aligned = align_annotation_tuples(a_anns, b_anns, focus_ids)
+        if len(aligned) > 1:
+            counts['ambiguous_total'] += 1
+            counts['ambiguous_analyses'] += len(aligned)
+        if is_punct:
+            continue
+        if not auto_analyzed:
+            outcome = 'not_automatically_analyzed'
+        elif any(status == 'COMMON' for status, a_id, b_id in aligned):
+            outcome = 'ambiguous_correct'
+        else:
+            outcome = 'incorrectly_analyzed'
+        counts[outcome] += 1
+        if auto_analyzed:
+            counts['analyzed'] += 1
+        if errors is not None:
+            errors.add_word(word_text, type_of_fix, outcome, a_anns, b_anns, aligned)
+    return counts
@@ -1,6 +1,7 @@
 from estnltk import Text
 from estnltk.taggers import VabamorfAnalyzer
 from estnltk.taggers.morph_analysis.morf_common import _is_empty_annotation
+from estnltk.taggers.morph_analysis.morf_common import _get_word_texts
 from estnltk import Annotation
 from estnltk.taggers import SentenceTokenizer
 from nltk.tokenize.simple import LineTokenizer
@@ -11,71 +12,103 @@ from estnltk.taggers.text_segmentation.pretokenized_text_compound_tokens_tagger
 from estnltk.taggers import Retagger
 from estnltk.taggers import UserDictTagger
 import os
+import re
+import time
+import hashlib
+import pickle
+import struct
+import tempfile
+import mmap
+from array import array
+import estnltk
+from collections import OrderedDict
+# The analyser for punctuation and the analyses it has produced so far.
+# Punctuation is a small closed set, so each punctuation token is analysed only once per process.
+_punct_analyser = None
+_punct_analyses = {}
+
+# Returns the analysis of a punctuation token with guessing enabled.
+def get_punctuation_analysis( word_text ):
+	global _punct_analyser
+	if word_text not in _punct_analyses:
+		if _punct_analyser is None:
+			_punct_analyser = VabamorfAnalyzer(guess=True, propername=True)
+		w=Text(word_text)
+		w.tag_layer(['sentences'])
+		_punct_analyser.tag(w)
+		# If for some reason there are multiple analyses
+		# the only first one will remain.
+		analysis=w.morph_analysis[0].annotations[0]
+		_punct_analyses[word_text]={attr: analysis[attr] for attr in w.morph_analysis.attributes}
+	return _punct_analyses[word_text]
+
 # Adds punctuation analysis to the text object.
 # Because punctuation is not analysed when guessing is disabled
 def add_punctuation_analysis ( text ):
-	#Redefine the tagger for analysing punctuation
-	punct_analyser = VabamorfAnalyzer(guess=True, propername=True)
 	for word in text.morph_analysis:
 		if _is_empty_annotation( word.annotations[0] ):
 			# Check if it is punctuation
-			if len(word.text) > 0 and not any([c.isalnum() for c in word.text]):
-				# It is a punctuation. Generate the analyses with guessing enabled and add them to the text
-				w=Text(word.text)
-				w.tag_layer(['sentences'])
-				punct_analyser.tag(w)
-				
-				analysis=w.morph_analysis[0].annotations
-				# If for some reason there are multiple analyses
-				# the only first one will remain.
-				if len(analysis) > 1:
-					analysis = [ analysis[0] ]
-					
-				#Rewrite the analysis
+			if len(word.text) > 0 and not any(c.isalnum() for c in word.text):
+				# It is a punctuation. Rewrite the analysis
+				analysis=get_punctuation_analysis(word.text)
 				word.clear_annotations()
-				word.add_annotation(Annotation(word, **analysis[0]))
+				word.add_annotation(Annotation(word, **analysis))
 				
 
 class word_prenormalizer( Retagger ):
     """A prenormalizer that replaces some letters that were used in the old writing system with the ones used in contemporary system"""
-    conf_param = ['letters_replaced']
+    conf_param = ['letters_replaced', 'translation_table']
     
-    def __init__(self):
+    def __init__(self, letters_replaced=None):
         # Set input/output layers
         self.input_layers = ['words']
         self.output_layer = 'words'
         self.output_attributes = ['normalized_form', 'is_prenormalized']
         # Set other configuration parameters
-        self.letters_replaced = {'W':'V', 'w':'v', 'I':'j'}
+        if letters_replaced is None:
+            letters_replaced = {'W':'V', 'w':'v', 'I':'j'}
+        self.letters_replaced = letters_replaced
+        # The words with any of the letters are found with a single translation
+        self.translation_table = str.maketrans(letters_replaced)
     
     def _change_layer(self, text, layers, status):
         # Get changeble layer
         changeble_layer = layers[self.output_layer]
         # Add new attribute to the layer
         changeble_layer.attributes += (self.output_attributes[-1], )
-        # Iterate over words and add new normalizations
+        # Collect the current normalized forms of all the words
+        form_counts = []
+        current_forms = []
         for span in changeble_layer:
-            # Get current normalized forms of the word
             current_norm_forms = [a['normalized_form'] for a in span.annotations]
             if current_norm_forms == [None]:
                 current_norm_forms = [span.text]
-            # Try to replace current normalized forms with forms from the lexicon
-            new_forms = []
-            change_status = []
-            for cur_form in current_norm_forms:
-                for letter in self.letters_replaced:
-                    new_form=cur_form.replace(letter, self.letters_replaced[letter])
-                    if new_form != cur_form:
-                        new_forms.append(new_form)
-                        change_status.append(True)
-                    else:
-                        new_forms.append(cur_form)
-                        change_status.append(False)
-            # Clear existing annotations and add new ones that have 1 extra attribute
+            form_counts.append(len(current_norm_forms))
+            current_forms.extend(current_norm_forms)
+        # Find the forms with the letters to replace in one pass. The words contain no whitespace,
+        # so the forms can be joined by newlines.
+        new_forms = '\n'.join(current_forms).translate(self.translation_table).split('\n')
+        # Add the new normalizations
+        position = 0
+        for span, form_count in zip(changeble_layer, form_counts):
+            cur_forms = current_forms[position:position+form_count]
+            changed_forms = new_forms[position:position+form_count]
+            position += form_count
+            if cur_forms == changed_forms:
+                # Nothing was replaced, the annotations only get the new attribute
+                for annotation in span.annotations:
+                    annotation['is_prenormalized'] = False
+                continue
+            # Clear existing annotations and add new ones that have 1 extra attribute.
+            # Each letter is replaced in a variant of its own, in the order of letters_replaced,
+            # so that the words with several old letters keep all their readings (e.g. "IW": IV, IW, jW).
+            # The forms without the letter are the same as the current form, which is added once.
             span.clear_annotations()
-            for form_id, new_form in enumerate( new_forms ):
-                span.add_annotation( Annotation(span, normalized_form=new_form, 
-                    is_prenormalized=change_status[form_id]) )
+            for cur_form in cur_forms:
+                for letter, replacement in self.letters_replaced.items():
+                    new_form = cur_form.replace(letter, replacement)
+                    span.add_annotation( Annotation(span, normalized_form=new_form, is_prenormalized=new_form != cur_form) )
+
 #Creates the user dict taggers for each location and global usage
 #Currently accepts only files with .tsv extension
 def create_user_dict_taggers(user_dict_dir):
@@ -90,93 +123,562 @@ def create_user_dict_taggers(user_dict_dir):
 		user_dictionaries[location].add_words_from_csv_file(os.path.join(user_dict_dir, i), encoding='utf-8', delimiter='\t')
 	return user_dictionaries
 
+#The version of the user dictionary index files, change it when the format of the entries changes
+user_dict_index_version = '3'
+#The index file starts with the magic, the offset and the length of its header.
+#The header has the fingerprints, offsets and lengths of the dictionaries of the locations.
+#A dictionary has the number of words, the offset tables of the words and of the entries, the words as utf-8 in sorted order
+#and the pickled entries. The offsets are in the native byte order, as the index is a local cache.
+user_dict_index_magic = b'OEUDIX03'
+user_dict_index_prefix = struct.Struct('<8sQQ')
+user_dict_count = struct.Struct('<Q')
+
+#The fingerprint of a user dictionary file
+def user_dict_fingerprint(dict_file):
+	with open(dict_file, 'rb') as fin:
+		data=fin.read()
+	return hashlib.sha256(data+('|'+user_dict_index_version+'|'+getattr(estnltk, '__version__', '')).encode('utf-8')).hexdigest()
+
+#Returns the entries that UserDictTagger makes from the dictionary file, keyed by word
+def compile_user_dict(dict_file):
+	tagger=UserDictTagger(validate_vm_categories=False)
+	tagger.add_words_from_csv_file(dict_file, encoding='utf-8', delimiter='\t')
+	return tagger._dict
+
+#Packs the entries of a dictionary for the index
+def pack_user_dict(entries):
+	words=sorted(word.encode('utf-8') for word in entries)
+	word_offsets=array('Q', [0])
+	entry_offsets=array('Q', [0])
+	packed_entries=[]
+	for word in words:
+		packed_entry=pickle.dumps(entries[word.decode('utf-8')], protocol=pickle.HIGHEST_PROTOCOL)
+		packed_entries.append(packed_entry)
+		word_offsets.append(word_offsets[-1]+len(word))
+		entry_offsets.append(entry_offsets[-1]+len(packed_entry))
+	return b''.join([user_dict_count.pack(len(words)), word_offsets.tobytes(), entry_offsets.tobytes()]+words+packed_entries)
+
+class MappedUserDict:
+    """The read-only dictionary of a location in the memory mapped index.
+       The words are found by binary search, so nothing is loaded into the memory of the process
+       until a word is found. The found entries are unpickled once and kept."""
+    
+    def __init__(self, buffer, offset):
+        self.buffer = buffer
+        self.count = user_dict_count.unpack_from(buffer, offset)[0]
+        table_start = offset+user_dict_count.size
+        table = memoryview(buffer)[table_start:table_start+16*(self.count+1)].cast('Q')
+        self.word_offsets = table[:self.count+1]
+        self.entry_offsets = table[self.count+1:]
+        self.words_start = table_start+16*(self.count+1)
+        self.entries_start = self.words_start+self.word_offsets[self.count]
+        self.found = {}
+    
+    def __len__(self):
+        return self.count
+    
+    def _find(self, word):
+        key = word.encode('utf-8')
+        buffer, word_offsets, words_start = self.buffer, self.word_offsets, self.words_start
+        low, high = 0, self.count
+        while low < high:
+            middle = (low+high)//2
+            if buffer[words_start+word_offsets[middle]:words_start+word_offsets[middle+1]] < key:
+                low = middle+1
+            else:
+                high = middle
+        if low < self.count and buffer[words_start+word_offsets[low]:words_start+word_offsets[low+1]] == key:
+            return low
+        return -1
+    
+    def __contains__(self, word):
+        return word in self.found or self._find(word) >= 0
+    
+    def get(self, word, default=None):
+        if word in self.found:
+            return self.found[word]
+        position = self._find(word)
+        if position < 0:
+            return default
+        entry = pickle.loads(self.buffer[self.entries_start+self.entry_offsets[position]:self.entries_start+self.entry_offsets[position+1]])
+        self.found[word] = entry
+        return entry
+
+#Reads the header of the open index file: {location: (fingerprint, offset, length)}
+def read_user_dict_index_header(fin):
+	magic, header_offset, header_length=user_dict_index_prefix.unpack(os.pread(fin.fileno(), user_dict_index_prefix.size, 0))
+	if magic != user_dict_index_magic:
+		raise ValueError('(!) {} is not a user dictionary index of version {}'.format(fin.name, user_dict_index_version))
+	return pickle.loads(os.pread(fin.fileno(), header_length, header_offset))
+
+def read_user_dict_index(index_file):
+	with open(index_file, 'rb') as fin:
+		return read_user_dict_index_header(fin)
+
+#Writes the index of the dictionaries with the given fingerprints.
+#The dictionaries whose fingerprints have not changed are copied from the old index, the others are compiled again.
+def write_user_dict_index(index_file, user_dict_dir, fingerprints, old_sections):
+	sections={}
+	# The workers may write the index at the same time, so each process has its own temporary file
+	tmp_file='{}.{}.tmp'.format(index_file, os.getpid())
+	with open(tmp_file, 'wb') as fout:
+		fout.write(user_dict_index_prefix.pack(user_dict_index_magic, 0, 0))
+		for location in sorted(fingerprints):
+			if location in old_sections and old_sections[location][0] == fingerprints[location]:
+				with open(index_file, 'rb') as fin:
+					fin.seek(old_sections[location][1])
+					data=fin.read(old_sections[location][2])
+			else:
+				data=pack_user_dict(compile_user_dict(os.path.join(user_dict_dir, location+".tsv")))
+			sections[location]=(fingerprints[location], fout.tell(), len(data))
+			# The next section starts at a multiple of 8, the offset tables are read as 8 byte integers
+			fout.write(data+b'\0'*(-len(data)%8))
+		header=pickle.dumps(sections, protocol=pickle.HIGHEST_PROTOCOL)
+		header_offset=fout.tell()
+		fout.write(header)
+		fout.seek(0)
+		fout.write(user_dict_index_prefix.pack(user_dict_index_magic, header_offset, len(header)))
+	os.replace(tmp_file, index_file)
+	return sections
+
+class UserDictIndex:
+    """The compiled user dictionaries of the locations, the global dictionary has the location 'global'.
+       The entries are the ones that UserDictTagger makes from the .tsv files, and they are applied in a single pass
+       over the morph_analysis layer, in the same order as the taggers: first the global entry and then the entry
+       of the location, which takes precedence.
+       The index file is memory mapped, so the processes that use the same index share its pages.
+       The dictionary of a location is opened the first time a text from the location is retagged.
+       If max_locations is given, at most that many location dictionaries (with the entries found in them) stay open
+       and the least recently used one is dropped. The global dictionary always stays open."""
+    
+    def __init__(self, index_file, max_locations=None):
+        self.index_file = index_file
+        self.max_locations = max_locations
+        # The file is mapped as long as the index is used, so that it can be replaced by another run in the meantime
+        with open(index_file, 'rb') as fin:
+            self.sections = read_user_dict_index_header(fin)
+            self.buffer = mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ)
+        self.loaded = OrderedDict()
+        self.loads = 0
+    
+    def __len__(self):
+        return len(self.sections)
+    
+    def __contains__(self, location):
+        return location in self.sections
+    
+    def location_entries(self, location):
+        """The MappedUserDict of the location, or None if the location has no dictionary."""
+        if location not in self.sections:
+            return None
+        if location in self.loaded:
+            self.loaded.move_to_end(location)
+            return self.loaded[location]
+        fingerprint, offset, length = self.sections[location]
+        entries = MappedUserDict(self.buffer, offset)
+        self.loads += 1
+        self.loaded[location] = entries
+        if self.max_locations is not None:
+            evictable = [loaded_location for loaded_location in self.loaded if loaded_location != 'global']
+            while len(evictable) > self.max_locations:
+                del self.loaded[evictable.pop(0)]
+        return entries
+    
+    def lookup(self, location, word):
+        """The entry of the word in the dictionary of the location, or None."""
+        entries = self.location_entries(location)
+        if entries is None:
+            return None
+        return entries.get(word)
+    
+    @staticmethod
+    def _lookup(entries, span_text, records):
+        # The same rewriting as a UserDictTagger pass makes. Returns None if no record was in the dictionary.
+        overwrite_records = []
+        records_merged = False
+        merged_records = []
+        for rec in records:
+            word_text = rec['normalized_text']
+            if word_text is None:
+                word_text = span_text
+            entry = entries.get(word_text)
+            if entry is not None:
+                if entry['merge']:
+                    # Overwrite the keys in the entry, keep all the other values
+                    rec = dict(rec)
+                    rec.update(entry['analysis'][0])
+                    records_merged = True
+                else:
+                    overwrite_records = entry['analysis']
+            merged_records.append(rec)
+        if overwrite_records:
+            return overwrite_records
+        if records_merged:
+            return merged_records
+        return None
+    
+    def retag(self, text):
+        dictionaries = [self.location_entries('global'), self.location_entries(text.meta['location'])]
+        dictionaries = [entries for entries in dictionaries if entries]
+        if not dictionaries:
+            return text
+        morph_layer = text['morph_analysis']
+        attribute_names = morph_layer.attributes
+        for span in morph_layer:
+            # Most of the words are not in the dictionaries
+            word_texts = {span.text if a['normalized_text'] is None else a['normalized_text'] for a in span.annotations}
+            if not any(word_text in entries for entries in dictionaries for word_text in word_texts):
+                continue
+            records = [{attr: a[attr] for attr in attribute_names} for a in span.annotations]
+            changed = False
+            for entries in dictionaries:
+                new_records = self._lookup(entries, span.text, records)
+                if new_records is not None:
+                    records = [{attr: rec.get(attr) for attr in attribute_names} for rec in new_records]
+                    changed = True
+            if changed:
+                span.clear_annotations()
+                for rec in records:
+                    span.add_annotation( Annotation(span, **rec) )
+        return text
+    
+    def __str__(self):
+        return 'User dictionaries: {} locations, {} loaded, {} loads'.format(len(self.sections), len(self.loaded), self.loads)
+
+#Writes the index again if the fingerprints of the dictionaries do not match the ones in the index
+def update_user_dict_index(index_file, user_dict_dir, fingerprints):
+	try:
+		sections=read_user_dict_index(index_file)
+	except (OSError, ValueError, pickle.UnpicklingError, EOFError, struct.error):
+		sections={}
+	if {location: sections[location][0] for location in sections} != fingerprints:
+		write_user_dict_index(index_file, user_dict_dir, fingerprints, sections)
+
+#Brings the index of the user dictionaries of the directory up to date and returns the path of the index file.
+#The index is kept in index_file (by default user_dicts.index in the directory), only the changed dictionaries are compiled again.
+#If the directory is not writable, the index is kept in the temporary directory.
+#The worker processes should not build the index themselves, the parent builds it before starting them and they open it.
+def build_user_dict_index(user_dict_dir, index_file=None):
+	if user_dict_dir=="":
+		return None
+	if index_file is None:
+		index_file=os.path.join(user_dict_dir, "user_dicts.index")
+	fingerprints={}
+	for i in os.listdir(user_dict_dir):
+		if i.endswith(".tsv"):
+			fingerprints[i.replace(".tsv", "")]=user_dict_fingerprint(os.path.join(user_dict_dir, i))
+	try:
+		update_user_dict_index(index_file, user_dict_dir, fingerprints)
+	except OSError:
+		index_file=os.path.join(tempfile.gettempdir(), 'user_dicts-'+hashlib.sha256(os.path.abspath(user_dict_dir).encode('utf-8')).hexdigest()+'.index')
+		update_user_dict_index(index_file, user_dict_dir, fingerprints)
+	return index_file
+
+#Opens the index file made by build_user_dict_index read-only, the dictionaries are not compiled.
+#Returns None, if there is no index (no user dictionaries).
+def open_user_dict_index(index_file, max_locations=None):
+	if index_file is None:
+		return None
+	return UserDictIndex(index_file, max_locations)
+
+#Returns the user dictionaries of the directory as a UserDictIndex, the index is built first if needed.
+def load_user_dict_index(user_dict_dir, index_file=None, max_locations=None):
+	return open_user_dict_index(build_user_dict_index(user_dict_dir, index_file), max_locations)
+
 class rule_based_normalizer( Retagger ):
-    """A rule based normalizer that applies the specified normalization rules"""
-    conf_param = ['normalizing_rules']
+    """A rule based normalizer that applies the specified normalization rules to the words that Vabamorf left unanalysed.
+       The rules are regular expressions, which are compiled into a single pattern, so that all the rules are applied
+       to a word form in one pass. The candidate forms of a text are analysed together with the settings of
+       the given analyzer and, if it is a CachedVabamorfAnalyzer, their analyses are memoized."""
+    conf_param = ['normalizing_rules', 'rules_pattern', 'replacements', 'vm_analyzer']
     
-    def __init__(self):
+    def __init__(self, normalizing_rules=None, vm_analyzer=None):
         # Set input/output layers
-        self.input_layers = ['morph_analysis']
+        self.input_layers = ['words', 'morph_analysis']
         self.output_layer = 'morph_analysis'
+        self.output_attributes = ()
         # Set other configuration parameters
-        self.normalizing_rules = {'nu$':'nud', 'nd$':'nud', 'bb':'b', 'dd':'d', 'gg':'g'}
+        if normalizing_rules is None:
+            normalizing_rules = {'nu$':'nud', 'nd$':'nud', 'bb':'b', 'dd':'d', 'gg':'g'}
+        self.normalizing_rules = normalizing_rules
+        # Each rule is a named group of the pattern, the name of the matching group gives the replacement
+        self.rules_pattern = re.compile('|'.join('(?P<rule{}>{})'.format(rule_id, rule)
+                                                 for rule_id, rule in enumerate(normalizing_rules)))
+        self.replacements = {'rule{}'.format(rule_id): replacement
+                             for rule_id, replacement in enumerate(normalizing_rules.values())}
+        if vm_analyzer is None:
+            vm_analyzer = CachedVabamorfAnalyzer(analysis_cache=AnalysisCache(), guess=False, propername=False)
+        self.vm_analyzer = vm_analyzer
+    
+    def normalize(self, word_form):
+        """Returns the word form with all the rules applied."""
+        return self.rules_pattern.sub(lambda match: self.replacements[match.lastgroup], word_form)
     
     def _change_layer(self, text, layers, status):
         # Get changeble layer
         changeble_layer = layers[self.output_layer]
-        # Add new attribute to the layer
-        changeble_layer.attributes += (self.output_attributes[-1], )
-        # Iterate over words and add new normalizations
-        for span in changeble_layer:
-            # Get current normalized forms of the word
-            current_norm_forms = [a['normalized_form'] for a in span.annotations]
-            if current_norm_forms == [None]:
-                current_norm_forms = [span.text]
-            # Try to replace current normalized forms with forms from the lexicon
-            new_forms = []
-            change_status = []
-            for cur_form in current_norm_forms:
-                for letter in self.letters_replaced:
-                    new_form=cur_form.replace(letter, self.letters_replaced[letter])
-                    if new_form != cur_form:
-                        new_forms.append(new_form)
-                        change_status.append(True)
-                    else:
-                        new_forms.append(cur_form)
-                        change_status.append(False)
-            # Clear existing annotations and add new ones that have 1 extra attribute
+        # Find the candidate forms of the words that have no analyses
+        word_candidates = []
+        for word, span in zip(layers['words'], changeble_layer):
+            if not _is_empty_annotation(span.annotations[0]):
+                continue
+            candidates = []
+            for word_form in _get_word_texts(word):
+                candidate = self.normalize(word_form)
+                if candidate != word_form and candidate not in candidates:
+                    candidates.append(candidate)
+            if candidates:
+                word_candidates.append((span, candidates))
+        if not word_candidates:
+            return
+        # Analyse the distinct candidates at once
+        distinct_candidates = list(OrderedDict.fromkeys(c for (span, candidates) in word_candidates for c in candidates))
+        analysis_kwargs = {'disambiguate': False, 'guess': self.vm_analyzer.guess, 'propername': self.vm_analyzer.propername,
+                           'compound': self.vm_analyzer.compound, 'phonetic': self.vm_analyzer.phonetic}
+        candidate_analyses = {}
+        for chunk_start in range(0, len(distinct_candidates), 15000):
+            chunk = [[c] for c in distinct_candidates[chunk_start:chunk_start+15000]]
+            for result in self.vm_analyzer._perform_vm_analysis(chunk, analysis_kwargs):
+                candidate_analyses[result['text']] = result['analysis']
+        # Replace the empty annotations with the analyses of the candidates
+        for span, candidates in word_candidates:
+            records = [dict(analysis, normalized_text=candidate) for candidate in candidates
+                       for analysis in candidate_analyses[candidate]]
+            if not records:
+                continue
             span.clear_annotations()
-            for form_id, new_form in enumerate( new_forms ):
-                span.add_annotation( Annotation(span, normalized_form=new_form, 
-                    is_normalized=change_status[form_id]) )
+            for record in records:
+                span.add_annotation( Annotation(span, **{attr: record.get(attr) for attr in changeble_layer.attributes}) )
 
 
+class AnalysisCache:
+    """A bounded LRU cache of Vabamorf analyses, keyed on (normalized_form, analyzer settings).
+       Counts the hits and misses, so that the effect of the cache can be reported.
+       The word forms that are analysed in advance (see CachedVabamorfAnalyzer.prefetch) are counted as misses."""
+    
+    def __init__(self, maxsize=100000):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+    
+    def get(self, key):
+        # Returns None, if the key has not been seen yet (or it has been evicted)
+        if key not in self._entries:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return self._entries[key]
+    
+    def count_misses(self, count):
+        self.misses += count
+    
+    def put(self, key, analyses):
+        self._entries[key] = analyses
+        self._entries.move_to_end(key)
+        if self.maxsize is not None and len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+    
+    def __contains__(self, key):
+        return key in self._entries
+    
+    def __len__(self):
+        return len(self._entries)
+    
+    def __str__(self):
+        lookups = self.hits + self.misses
+        hit_rate = (self.hits * 100.0) / lookups if lookups > 0 else 0.0
+        return 'Analysis cache: {} hits, {} misses ({:.2f}% hits), {} word forms cached'.format(self.hits, self.misses, hit_rate, len(self))
 
-def apply_pipeline(text, conf):
-	#Initialize the configuration
-	#If alphabet corrections should be performed
-	if 'prenormalize' not in conf:
-		conf['prenormalize']=True
-	if 'add_punctuation_analyses' not in conf:
-		conf['add_punctuation_analyses'] = True
-	#If user dictionary should be used
-	if 'user_dictionaries' not in conf:
-		conf['user_dictionaries']=None
-	if 'vm_analyzer' not in conf:
-		conf['vm_analyzer'] = VabamorfAnalyzer(guess=False, propername=False)
-	if 'newline_sentence_tokenizer' not in conf:
-		conf['newline_sentence_tokenizer'] = SentenceTokenizer( base_sentence_tokenizer=LineTokenizer() )
-	if 'tokens_tagger' not in conf:
-		conf['tokens_tagger'] = TokensTagger()
-	if conf['prenormalize'] and 'prenormalizer' not in conf:
-		conf['prenormalizer']=word_prenormalizer()
-	#For testing the pretokenized functions
-	txt=text.text
-	multiword_expressions = []
-	raw_words = txt.split(' ')
-	for raw_word in raw_words:
-		if ' ' in raw_word:
-			multiword_expressions.append(raw_token)
-	conf['tokens_tagger'].tag(text)
-	multiword_expressions = [mw.split() for mw in multiword_expressions]
-	compound_tokens_tagger = PretokenizedTextCompoundTokensTagger( multiword_units = multiword_expressions )
-	compound_tokens_tagger.tag(text)
-	#CompoundTokenTagger(tag_initials = False).tag(text)
-	#text.tag_layer(['sentences'])
-	text.tag_layer(['words'])
-	conf['newline_sentence_tokenizer'].tag(text)
-	if conf['prenormalize']:
-		conf['prenormalizer'].retag(text)
-	conf['vm_analyzer'].tag(text)
-	# Perform the fixes
-	if conf['user_dictionaries']:
-		if 'global' in conf['user_dictionaries']:
-			conf['user_dictionaries']['global'].retag(text)
-		if text.meta['location'] in conf['user_dictionaries']:
-			conf['user_dictionaries'][text.meta['location']].retag(text)
-	if conf['add_punctuation_analyses']:
-		add_punctuation_analysis( text )
-	return text
-
+class CachedVabamorfAnalyzer( VabamorfAnalyzer ):
+    """A VabamorfAnalyzer that memoizes the analyses of word forms in an AnalysisCache.
+       Only the forms that are not in the cache are passed to Vabamorf (in one call per sentence).
+       The cache is bypassed if guessing or proper name analysis is switched on,
+       because then the analysis of a word depends on its context."""
+    conf_param = VabamorfAnalyzer.conf_param + ['analysis_cache']
+    
+    def __init__(self, analysis_cache=None, **kwargs):
+        super().__init__(**kwargs)
+        self.analysis_cache = analysis_cache if analysis_cache is not None else AnalysisCache()
+    
+    @staticmethod
+    def _settings_key(analysis_kwargs):
+        # All the settings are a part of the key, so that the analyzers with different settings can share the cache
+        return tuple(sorted(analysis_kwargs.items()))
+    
+    def _analysis_kwargs(self):
+        # The same settings that VabamorfAnalyzer passes to _perform_vm_analysis
+        return {'disambiguate': False, 'guess': self.guess, 'propername': self.propername,
+                'compound': self.compound, 'phonetic': self.phonetic}
+    
+    def _perform_vm_analysis( self, sentence_words, analysis_kwargs ):
+        if analysis_kwargs['guess'] or analysis_kwargs['propername']:
+            return super()._perform_vm_analysis( sentence_words, analysis_kwargs )
+        settings = self._settings_key(analysis_kwargs)
+        flat_words = [w for word_variants in sentence_words for w in word_variants]
+        # Look up the known forms and analyse the unknown ones in one call
+        analyses = [self.analysis_cache.get((w, settings)) for w in flat_words]
+        missing = list(OrderedDict.fromkeys(w for w, analysis in zip(flat_words, analyses) if analysis is None))
+        if missing:
+            new_analyses = self._analyse_forms(missing, analysis_kwargs)
+            analyses = [new_analyses[w] if analysis is None else analysis for w, analysis in zip(flat_words, analyses)]
+        # Give out copies, because the analyses will be modified later in the pipeline
+        return [{'text': w, 'analysis': [dict(a, root_tokens=list(a['root_tokens'])) for a in analysis]} for w, analysis in zip(flat_words, analyses)]
+    
+    def _analyse_forms(self, forms, analysis_kwargs):
+        """Analyses the distinct word forms with Vabamorf and stores them in the cache. Returns the analyses by the forms."""
+        settings = self._settings_key(analysis_kwargs)
+        new_analyses = {}
+        # Vabamorf can fail on very long word lists, so the forms are analysed in chunks
+        for i in range(0, len(forms), 15000):
+            for result in self._vm_instance.analyze(words=forms[i:i+15000], **analysis_kwargs):
+                new_analyses[result['text']] = tuple(result['analysis'])
+                self.analysis_cache.put((result['text'], settings), new_analyses[result['text']])
+        return new_analyses
+    
+    def prefetch(self, forms):
+        """Analyses the word forms that are not in the cache yet with one bulk call,
+           so that the texts containing them can be tagged without calling Vabamorf again."""
+        if self.guess or self.propername:
+            return
+        analysis_kwargs = self._analysis_kwargs()
+        settings = self._settings_key(analysis_kwargs)
+        missing = list(OrderedDict.fromkeys(w for w in forms if (w, settings) not in self.analysis_cache))
+        if missing:
+            self.analysis_cache.count_misses(len(missing))
+            self._analyse_forms(missing, analysis_kwargs)
 
+class MorphPipeline:
+    """The morphological analysis pipeline.
+       The configuration is validated and all the taggers are created once,
+       so that the same pipeline can be applied to many texts."""
+    conf_keys = ['prenormalize', 'normalize', 'add_punctuation_analyses', 'user_dictionaries', 'analysis_cache',
+                 'vm_analyzer', 'newline_sentence_tokenizer', 'tokens_tagger', 'prenormalizer', 'normalizer', 'pipeline']
+    
+    def __init__(self, conf=None):
+        if conf is None:
+            conf = {}
+        unknown_keys = [key for key in conf if key not in self.conf_keys]
+        if unknown_keys:
+            raise ValueError('(!) Unknown configuration parameters: {!r}'.format(unknown_keys))
+        #Initialize the configuration
+        #If alphabet corrections should be performed
+        if 'prenormalize' not in conf:
+            conf['prenormalize']=True
+        #If the rule based normalization should be applied to the unanalysed words
+        if 'normalize' not in conf:
+            conf['normalize']=False
+        if 'add_punctuation_analyses' not in conf:
+            conf['add_punctuation_analyses'] = True
+        #If user dictionary should be used
+        if 'user_dictionaries' not in conf:
+            conf['user_dictionaries']=None
+        #If the analyses of word forms should be memoized (an AnalysisCache or None)
+        if 'analysis_cache' not in conf:
+            conf['analysis_cache']=None
+        if 'vm_analyzer' not in conf:
+            if conf['analysis_cache'] is not None:
+                conf['vm_analyzer'] = CachedVabamorfAnalyzer(analysis_cache=conf['analysis_cache'], guess=False, propername=False)
+            else:
+                conf['vm_analyzer'] = VabamorfAnalyzer(guess=False, propername=False)
+        if 'newline_sentence_tokenizer' not in conf:
+            conf['newline_sentence_tokenizer'] = SentenceTokenizer( base_sentence_tokenizer=LineTokenizer() )
+        if 'tokens_tagger' not in conf:
+            conf['tokens_tagger'] = TokensTagger()
+        if conf['prenormalize'] and 'prenormalizer' not in conf:
+            conf['prenormalizer']=word_prenormalizer()
+        #The normalizer analyses the candidate forms with the same analyzer (and settings) as the pipeline
+        if conf['normalize'] and 'normalizer' not in conf:
+            conf['normalizer']=rule_based_normalizer(vm_analyzer=conf['vm_analyzer'])
+        self.conf = conf
+        # Vabamorf keeps some state from the analyses made with guessing: after the first one, roman numerals
+        # get also the Y analysis without guessing. The punctuation analyser is used before any text is analysed,
+        # so that the results do not depend on the order or batching of the texts.
+        if conf['add_punctuation_analyses']:
+            get_punctuation_analysis('.')
+        # The texts are split into tokens only by whitespace, so there are no multiword units
+        self.compound_tokens_tagger = PretokenizedTextCompoundTokensTagger( multiword_units = [] )
+        # The seconds spent in the stages of the pipeline
+        self.timings = {}
+    
+    def _time(self, stage, start):
+        # Adds the time since start to the stage and returns the current time
+        now = time.perf_counter()
+        self.timings[stage] = self.timings.get(stage, 0.0)+now-start
+        return now
+    
+    def pop_timings(self):
+        """Returns the timings of the stages since the last call and starts them from zero."""
+        timings = self.timings
+        self.timings = {}
+        return timings
+    
+    def _prepare(self, text):
+        # Tokenization, sentences and prenormalization
+        conf = self.conf
+        start = time.perf_counter()
+        conf['tokens_tagger'].tag(text)
+        self.compound_tokens_tagger.tag(text)
+        #CompoundTokenTagger(tag_initials = False).tag(text)
+        #text.tag_layer(['sentences'])
+        text.tag_layer(['words'])
+        conf['newline_sentence_tokenizer'].tag(text)
+        if conf['prenormalize']:
+            conf['prenormalizer'].retag(text)
+        self._time('preparation', start)
+        return text
+    
+    def _analyse(self, text):
+        # Morphological analysis and the fixes
+        conf = self.conf
+        start = time.perf_counter()
+        conf['vm_analyzer'].tag(text)
+        start = self._time('analysis', start)
+        # Perform the fixes
+        if isinstance(conf['user_dictionaries'], UserDictIndex):
+            conf['user_dictionaries'].retag(text)
+        elif conf['user_dictionaries']:
+            if 'global' in conf['user_dictionaries']:
+                conf['user_dictionaries']['global'].retag(text)
+            if text.meta['location'] in conf['user_dictionaries']:
+                conf['user_dictionaries'][text.meta['location']].retag(text)
+        start = self._time('user_dictionaries', start)
+        # The words that are still unanalysed get the analyses of their normalized forms
+        if conf['normalize']:
+            conf['normalizer'].retag(text)
+            start = self._time('normalization', start)
+        if conf['add_punctuation_analyses']:
+            add_punctuation_analysis( text )
+            self._time('punctuation', start)
+        return text
+    
+    def process(self, text):
+        return self._analyse(self._prepare(text))
+    
+    def process_many(self, texts, batch_size=100):
+        """Processes the texts in batches. If the analyzer is a CachedVabamorfAnalyzer, the distinct
+           word forms of a batch are analysed with one Vabamorf call before the texts are tagged."""
+        batch = []
+        for text in texts:
+            batch.append(self._prepare(text))
+            if len(batch) == batch_size:
+                yield from self._analyse_batch(batch)
+                batch = []
+        yield from self._analyse_batch(batch)
+    
+    def _analyse_batch(self, batch):
+        vm_analyzer = self.conf['vm_analyzer']
+        if isinstance(vm_analyzer, CachedVabamorfAnalyzer):
+            start = time.perf_counter()
+            vm_analyzer.prefetch(form for text in batch for word in text['words'] for form in _get_word_texts(word))
+            self._time('analysis', start)
+        for text in batch:
+            yield self._analyse(text)
 
+#Applies the pipeline with the given configuration to the text.
+#The pipeline is created on the first call and kept in the configuration.
+def apply_pipeline(text, conf):
+	if 'pipeline' not in conf:
+		conf['pipeline']=MorphPipeline(conf)
+	return conf['pipeline'].process(text)
@@ -0,0 +1,59 @@
+import corpus_readers
+from corpus_readers import CorpusCache, read_corpus
+
+corpus_csv = '''id|maakond|year|text
+1|Kokora|1870|"Tulli <b>ette</b> Josep"
+2|Aru|1871|"Mihkel ütles"
+3|Aru|1880|"kolmas"
+'''
+
+
+def write_corpus(tmp_path):
+    path = tmp_path / 'corpus.csv'
+    path.write_text(corpus_csv, encoding='utf-8')
+    return str(path)
+
+
+def records(texts):
+    return [(text.text, text.meta) for text in texts]
+
+
+def opened_caches(monkeypatch):
+    # Collects the caches that read_corpus opens
+    caches = []
+    open_corpus_cache = corpus_readers.open_corpus_cache
+    def open_and_collect(cache_path, fingerprint):
+        cache = open_corpus_cache(cache_path, fingerprint)
+        if cache is not None:
+            caches.append(cache)
+        return cache
+    monkeypatch.setattr(corpus_readers, 'open_corpus_cache', open_and_collect)
+    return caches
+
+
+def test_cache_round_trip(tmp_path, monkeypatch):
+    path = write_corpus(tmp_path)
+    cache_path = str(tmp_path / 'corpus.cache')
+    expected = records(read_corpus(path))
+    assert records(read_corpus(path, cache_path=cache_path)) == expected
+    caches = opened_caches(monkeypatch)
+    assert records(read_corpus(path, cache_path=cache_path)) == expected
+    assert len(caches) == 1
+    assert caches[0]._data.closed
+    with CorpusCache(cache_path) as cache:
+        assert len(cache) == 3
+        assert cache.get('2') == ('Mihkel ütles', {'location': 'aru', 'year': '1871', 'id': '2'})
+        assert cache.get('4') is None
+    assert cache._data.closed
+
+
+def test_cache_closed_when_not_read_to_the_end(tmp_path, monkeypatch):
+    path = write_corpus(tmp_path)
+    cache_path = str(tmp_path / 'corpus.cache')
+    records(read_corpus(path, cache_path=cache_path))
+    caches = opened_caches(monkeypatch)
+    texts = read_corpus(path, cache_path=cache_path)
+    assert next(texts).text == 'Tulli ette Josep'
+    assert not caches[0]._data.closed
+    texts.close()
+    assert caches[0]._data.closed
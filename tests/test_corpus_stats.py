@@ -0,0 +1,78 @@
+import random
+from collections import Counter
+
+from corpus_stats import WordCounter
+
+
+def stream(seed, length=2000, vocabulary=50):
+    # A skewed stream of words, so that there are both frequent words and hapax legomena
+    rng = random.Random(seed)
+    words = ['w{}'.format(i) for i in range(vocabulary)]
+    weights = [1.0/(i+1) for i in range(vocabulary)]
+    return [(word, rng.choice([1, 1, 1, 2])) for word in rng.choices(words, weights, k=length)]
+
+
+def test_exact_counter():
+    words = stream(0)
+    counter = WordCounter()
+    exact = Counter()
+    for word, count in words:
+        counter.add(word, count)
+        exact[word] += count
+    assert counter.counts == dict(exact)
+    assert counter.hapax == sum(1 for count in exact.values() if count == 1)
+
+
+def test_capped_counter_against_exact():
+    for seed in range(20):
+        for capacity in (1, 2, 5, 10, 20):
+            exact = WordCounter()
+            capped = WordCounter(capacity)
+            for word, count in stream(seed, length=300):
+                exact.add(word, count)
+                capped.add(word, count)
+                assert len(capped) <= capacity
+                # The hapax legomena are those of the counted words
+                assert capped.hapax == sum(1 for count in capped.counts.values() if count == 1)
+                assert capped.hapax >= 0
+            assert len(exact) > capacity
+            # The counts of the counted words are upper bounds of the exact ones
+            for word, count in capped.items():
+                assert count >= exact[word]
+            assert sum(capped.counts.values()) == sum(exact.counts.values())
+
+
+def test_capped_counter_without_evictions_is_exact():
+    words = stream(1, vocabulary=30)
+    exact = WordCounter()
+    capped = WordCounter(30)
+    for word, count in words:
+        exact.add(word, count)
+        capped.add(word, count)
+    assert capped.counts == exact.counts
+    assert capped.hapax == exact.hapax
+
+
+def test_eviction_of_hapax():
+    counter = WordCounter(1)
+    counter.add('a')
+    assert counter.hapax == 1
+    # 'b' replaces 'a' and gets its count, so it is not a hapax legomenon
+    counter.add('b')
+    assert counter.counts == {'b': 2}
+    assert counter.hapax == 0
+    counter.add('c')
+    assert counter.counts == {'c': 3}
+    assert counter.hapax == 0
+
+
+def test_merge_capped():
+    first = WordCounter(3)
+    second = WordCounter(3)
+    for word, count in stream(2, length=200):
+        first.add(word, count)
+    for word, count in stream(3, length=200):
+        second.add(word, count)
+    first.merge(second)
+    assert len(first) <= 3
+    assert first.hapax == sum(1 for count in first.counts.values() if count == 1)
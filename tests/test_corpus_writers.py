@@ -0,0 +1,142 @@
+import os
+
+import pytest
+from estnltk import Layer, Text
+
+from corpus_writers import ColumnarSink, analysis_columns, columnar_fields, format_analysis_tsv, tsv_field, write_analysis_tsv
+
+data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+morph_attributes = ['normalized_text', 'lemma', 'root', 'root_tokens', 'ending', 'clitic', 'form', 'partofspeech']
+
+
+def analysis(root, ending='0', clitic='', form='', partofspeech='S'):
+    return {'normalized_text': None, 'lemma': root, 'root': root, 'root_tokens': [root],
+            'ending': ending, 'clitic': clitic, 'form': form, 'partofspeech': partofspeech}
+
+
+empty = {attribute: None for attribute in morph_attributes}
+
+# The words of the sample text with their analyses, the sentences are separated by newlines
+sample_words = [
+    [('Tulli', [analysis('tulema', 'i', form='s', partofspeech='V')]),
+     ('ette', [analysis('ette', partofspeech='D'), analysis('ette', partofspeech='K')]),
+     ('Josep', [empty]),
+     ('"Kallaste"', [analysis('"Kallaste"', form='sg n', partofspeech='H')]),
+     (',', [analysis(',', ending='', partofspeech='Z')]),
+     ('ja', [analysis('ja', ending='0', partofspeech='J')])],
+    [('a\tb', [analysis('a\tb', form='sg n')]),
+     ('Mihkel', [analysis('Mihkel', form='sg n', partofspeech='H'), analysis('mihkel', form='sg n'),
+                 analysis('x"y', clitic='gi', form='sg g')]),
+     ('ütles', [analysis('ütle', 's', form='s', partofspeech='V')]),
+     ('¤', [empty]),
+     ('.', [analysis('.', ending='', partofspeech='Z')])],
+    [('üks', [analysis('üks', form='sg n', partofspeech='N')]),
+     ('"', [analysis('"', ending='', partofspeech='Z')]),
+     ('rida\r\nkaks', [analysis('rida\nkaks', form='sg n')]),
+     ('!', [empty])],
+]
+
+
+def sample_text():
+    text = Text('\n'.join(' '.join(word for word, analyses in sentence) for sentence in sample_words))
+    layer = Layer(name='morph_analysis', text_object=text, attributes=morph_attributes, ambiguous=True)
+    boundaries = []
+    start = 0
+    for sentence in sample_words:
+        sentence_start = start
+        for word, analyses in sentence:
+            end = start+len(word)
+            for annotation in analyses:
+                layer.add_annotation((start, end), **annotation)
+            start = end+1
+        boundaries.append((sentence_start, start-1))
+    text.add_layer(layer)
+    return text, boundaries
+
+
+def read_golden(name):
+    with open(os.path.join(data_dir, name), 'rb') as fin:
+        return fin.read()
+
+
+def test_sentences_golden():
+    text, boundaries = sample_text()
+    assert format_analysis_tsv(text, boundaries).encode('utf-8') == read_golden('analysis_sentences.tsv')
+
+
+def test_headers_golden():
+    text, boundaries = sample_text()
+    assert format_analysis_tsv(text, add_headers=True).encode('utf-8') == read_golden('analysis_headers.tsv')
+
+
+def test_write_golden(tmp_path):
+    text, boundaries = sample_text()
+    out_file_name = str(tmp_path / 'analysis.tsv')
+    write_analysis_tsv(text, out_file_name, boundaries)
+    with open(out_file_name, 'rb') as fin:
+        assert fin.read() == read_golden('analysis_sentences.tsv')
+
+
+def test_wrong_boundaries():
+    text, boundaries = sample_text()
+    with pytest.raises(AssertionError):
+        format_analysis_tsv(text, boundaries[:1]+[(0, 1)])
+
+
+@pytest.mark.parametrize('value, field', [
+    (None, ''), ('', ''), ('maja', 'maja'), (5, '5'),
+    ('a\tb', '"a\tb"'), ('a\nb', '"a\nb"'), ('a\rb', '"a\rb"'), ('x"y', '"x""y"'), ('"', '""""'),
+])
+def test_tsv_field(value, field):
+    assert tsv_field(value) == field
+
+
+def columnar_text(record_id):
+    # The sample text with the sentences layer and the id that the columnar output needs
+    text, boundaries = sample_text()
+    sentences = Layer(name='sentences', text_object=text, attributes=[])
+    for start, end in boundaries:
+        sentences.add_annotation((start, end))
+    text.add_layer(sentences)
+    text.meta['id'] = record_id
+    return text
+
+
+def test_analysis_columns():
+    columns = analysis_columns(columnar_text(7))
+    rows = list(zip(*[columns[field] for field in columnar_fields]))
+    assert len(rows) == sum(len(analyses) for sentence in sample_words for word, analyses in sentence)
+    assert rows[0] == ('7', 0, 'Tulli', 0, 'tulema', 'i', '', 'V', 's')
+    assert rows[2] == ('7', 0, 'ette', 1, 'ette', '0', '', 'K', '')
+    # The words without analyses have an empty row
+    assert rows[3] == ('7', 0, 'Josep', 0, None, None, None, None, None)
+    assert rows[7] == ('7', 1, 'a\tb', 0, 'a\tb', '0', '', 'S', 'sg n')
+    assert rows[-1] == ('7', 2, '!', 0, None, None, None, None, None)
+
+
+@pytest.mark.parametrize('output_format', ['parquet', 'arrow'])
+def test_columnar_round_trip(tmp_path, output_format):
+    pyarrow = pytest.importorskip('pyarrow')
+    # The small row groups make the sink flush several times
+    sink = ColumnarSink(str(tmp_path), output_format, row_group_size=5)
+    expected = {'kokora': {field: [] for field in columnar_fields}, 'aru': {field: [] for field in columnar_fields}}
+    for record_id, location in ((1, 'kokora'), (2, 'aru'), (3, 'kokora')):
+        columns = analysis_columns(columnar_text(record_id))
+        sink.add(location, columns)
+        for field in columnar_fields:
+            expected[location][field].extend(columns[field])
+    # The files get their names only when the sink is closed
+    assert not os.path.exists(str(tmp_path / ('kokora.'+output_format)))
+    sink.close()
+    assert sorted(os.listdir(str(tmp_path))) == sorted(location+'.'+output_format for location in expected)
+    for location, columns in expected.items():
+        file_name = str(tmp_path / (location+'.'+output_format))
+        if output_format == 'parquet':
+            import pyarrow.parquet
+            table = pyarrow.parquet.read_table(file_name)
+        else:
+            import pyarrow.ipc
+            table = pyarrow.ipc.open_file(file_name).read_all()
+        assert table.schema.equals(sink.schema)
+        assert table.to_pydict() == columns
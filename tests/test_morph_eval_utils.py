@@ -0,0 +1,124 @@
+import pytest
+from estnltk import Layer, Text
+
+from eval_metrics import EvalMetrics
+from morph_eval_utils import evaluate_morph_analysis
+
+manual_attributes = ['root', 'lemma', 'root_tokens', 'ending', 'clitic', 'partofspeech', 'form']
+
+
+def analysis(root, partofspeech='S', form='sg n', ending='0'):
+    return {'root': root, 'lemma': root, 'root_tokens': [root], 'ending': ending, 'clitic': '',
+            'partofspeech': partofspeech, 'form': form}
+
+
+def punctuation(word):
+    return analysis(word, partofspeech='Z', form='', ending='')
+
+
+empty = {attribute: None for attribute in manual_attributes}
+
+# The words with their manual and automatic analyses, each of them checks a rule of the counting
+sample_words = [
+    # The same analysis: unambiguous, analyzed and correct
+    ('maja', [analysis('maja')], [analysis('maja')]),
+    # The same two analyses: unambiguous
+    ('kuuse', [analysis('kuusk', form='sg g'), analysis('kuusk', form='sg p')],
+              [analysis('kuusk', form='sg p'), analysis('kuusk', form='sg g')]),
+    # The manual analysis is one of the two automatic ones: ambiguous and correct
+    ('ette', [analysis('ette', 'D', '')], [analysis('ette', 'D', ''), analysis('ette', 'K', '')]),
+    # The form differs: incorrectly analyzed, not ambiguous
+    ('läks', [analysis('mine', 'V', 's', 's')], [analysis('mine', 'V', 'sid', 's')]),
+    # The automatic analysis has no attribute in common with the manual one: incorrectly analyzed
+    ('Jaan', [analysis('Jaan', 'H')], [{'root': 'jaa', 'lemma': 'jaama', 'root_tokens': ['jaa'], 'ending': 'n',
+                                        'clitic': 'gi', 'partofspeech': 'V', 'form': 'n'}]),
+    # No automatic analysis: not automatically analyzed
+    ('Josep', [analysis('Josep', 'H')], [empty]),
+    # No manual analysis: not manually analyzed, whatever the automatic analysis
+    ('kohtomees', [empty], [analysis('kohtomees')]),
+    # Punctuation with the same analysis: unambiguous, but left out of the metrics
+    (',', [punctuation(',')], [punctuation(',')]),
+    # Punctuation with differing analyses: left out of the metrics and of the unambiguous words
+    ('"', [punctuation('"')], [punctuation('"'), analysis('"', 'Y', '')]),
+    # Punctuation without a manual analysis: not counted as not manually analyzed
+    ('.', [empty], [punctuation('.')]),
+]
+
+# The counts checked by hand from the words above
+expected_counts = {
+    'total': 10,
+    'punct': 3,
+    # maja, kuuse and ,
+    'unambiguous': 3,
+    # maja and kuuse
+    'unambiguous_no_punct': 2,
+    # ette
+    'ambiguous_correct': 1,
+    # The words with more than one alignment: ette and " (COMMON, EXTRA), Jaan and Josep (MISSING, EXTRA)
+    'ambiguous_total': 4,
+    'ambiguous_analyses': 8,
+    # läks and Jaan
+    'incorrectly_analyzed': 2,
+    # maja, kuuse, ette, läks and Jaan
+    'analyzed': 5,
+    # Josep
+    'not_automatically_analyzed': 1,
+    # kohtomees
+    'not_manually_analyzed': 1,
+}
+
+
+def sample_text():
+    text = Text(' '.join(word for word, manual, auto in sample_words))
+    manual_layer = Layer(name='manual_morph', text_object=text, attributes=manual_attributes, ambiguous=True)
+    auto_layer = Layer(name='morph_analysis', text_object=text, attributes=['normalized_text']+manual_attributes, ambiguous=True)
+    start = 0
+    for word, manual, auto in sample_words:
+        end = start+len(word)
+        for annotation in manual:
+            manual_layer.add_annotation((start, end), **annotation)
+        for annotation in auto:
+            auto_layer.add_annotation((start, end), normalized_text=word, **annotation)
+        start = end+1
+    text.add_layer(manual_layer)
+    text.add_layer(auto_layer)
+    return text
+
+
+def test_counts():
+    assert evaluate_morph_analysis(sample_text()) == expected_counts
+
+
+def test_metrics():
+    metrics = EvalMetrics('sample', evaluate_morph_analysis(sample_text()))
+    assert metrics.total_no_punct == 7
+    assert metrics.total_manually_analyzed == 6
+    # maja, kuuse and ette
+    assert metrics.correctly_analyzed == 3
+    assert metrics.precision == 3/5
+    assert metrics.recall == 3/6
+    assert metrics.analyzed == metrics.total_manually_analyzed-metrics.not_automatically_analyzed
+    # The punctuation that is not unambiguous is not subtracted from the unambiguous words
+    assert metrics.unambiguous_no_punct != metrics.unambiguous-metrics.punct
+
+
+def test_check():
+    counts = evaluate_morph_analysis(sample_text())
+    EvalMetrics('sample', counts).check()
+    # A word counted twice
+    with pytest.raises(AssertionError):
+        EvalMetrics('sample', dict(counts, incorrectly_analyzed=counts['incorrectly_analyzed']+1)).check()
+    # A word with an automatic analysis that is not counted as analyzed
+    with pytest.raises(AssertionError):
+        EvalMetrics('sample', dict(counts, analyzed=counts['analyzed']-1)).check()
+
+
+def test_old_counts_differ():
+    # The counts that the script made before the single-pass evaluation, they are not consistent:
+    # unambiguous_no_punct was unambiguous - punct, and a word whose automatic analysis had nothing in common
+    # with the manual one (Jaan) was counted as not automatically analyzed, although it has an automatic
+    # analysis (which is why the old script had to allow analyzed_count to differ from analyzed).
+    old_counts = dict(expected_counts, unambiguous_no_punct=expected_counts['unambiguous']-expected_counts['punct'],
+                      incorrectly_analyzed=1, not_automatically_analyzed=2)
+    with pytest.raises(AssertionError):
+        EvalMetrics('sample', old_counts).check()
@@ -0,0 +1,78 @@
+import pytest
+from estnltk import Text
+from estnltk.taggers import TokensTagger, VabamorfAnalyzer
+
+from morph_pipeline import AnalysisCache, CachedVabamorfAnalyzer, MorphPipeline, word_prenormalizer
+
+
+def roots(results):
+    return [[analysis['root'] for analysis in result['analysis']] for result in results]
+
+
+def test_shared_cache_keeps_settings_apart():
+    cache = AnalysisCache()
+    compound = CachedVabamorfAnalyzer(analysis_cache=cache, guess=False, propername=False)
+    no_compound = CachedVabamorfAnalyzer(analysis_cache=cache, guess=False, propername=False, compound=False)
+    words = [['raudteejaam']]
+    assert roots(compound._perform_vm_analysis(words, compound._analysis_kwargs())) == [['raud_tee_jaam']]
+    assert roots(no_compound._perform_vm_analysis(words, no_compound._analysis_kwargs())) == [['raudteejaam']]
+    assert roots(compound._perform_vm_analysis(words, compound._analysis_kwargs())) == [['raud_tee_jaam']]
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_all_settings_are_in_the_key():
+    cache = AnalysisCache()
+    analyzer = CachedVabamorfAnalyzer(analysis_cache=cache, guess=False, propername=False)
+    analysis_kwargs = analyzer._analysis_kwargs()
+    analyzer._perform_vm_analysis([['majadele']], analysis_kwargs)
+    analyzer._perform_vm_analysis([['majadele']], dict(analysis_kwargs, stem=True))
+    assert cache.misses == 2
+    assert len(cache) == 2
+
+
+def test_prefetched_forms_are_misses():
+    cache = AnalysisCache()
+    analyzer = CachedVabamorfAnalyzer(analysis_cache=cache, guess=False, propername=False)
+    analyzer.prefetch(['maja', 'majadele', 'maja'])
+    assert (cache.hits, cache.misses) == (0, 2)
+    analyzer.prefetch(['maja', 'raudteejaam'])
+    assert (cache.hits, cache.misses) == (0, 3)
+    analyzer._perform_vm_analysis([['maja'], ['raudteejaam'], ['majadele']], analyzer._analysis_kwargs())
+    assert (cache.hits, cache.misses) == (3, 3)
+
+
+@pytest.mark.parametrize('word, forms', [
+    ('IW', [('IV', True), ('IW', False), ('jW', True)]),
+    ('Wilde', [('Vilde', True), ('Wilde', False)]),
+    ('W', [('V', True), ('W', False)]),
+    ('WI', [('VI', True), ('WI', False), ('Wj', True)]),
+    ('maja', [(None, False)]),
+])
+def test_prenormalized_forms(word, forms):
+    text = Text(word)
+    text.tag_layer(['words'])
+    word_prenormalizer().retag(text)
+    assert [(a['normalized_form'], a['is_prenormalized']) for a in text.words[0].annotations] == forms
+
+
+@pytest.mark.parametrize('word, analyses', [
+    # Each letter is replaced separately, so the readings of both variants are kept
+    ('IW', [('IV', 'IV', 'O', '?'), ('IV', 'IV', 'Y', '?'), ('IW', 'IW', 'Y', '?')]),
+    # The prenormalized form comes first, when both forms have analyses
+    ('Wilde', [('Vilde', 'Vilde', 'H', 'sg g'), ('Vilde', 'Vilde', 'H', 'sg n'), ('Wilde', 'Wilde', 'H', 'sg n')]),
+])
+def test_prenormalized_analyses(word, analyses):
+    text = MorphPipeline({'tokens_tagger': TokensTagger()}).process(Text(word))
+    assert [(a['normalized_text'], a['root'], a['partofspeech'], a['form']) for a in text.morph_analysis[0].annotations] == analyses
+
+
+@pytest.mark.parametrize('vm_analyzer', [
+    VabamorfAnalyzer(guess=False, propername=False, compound=False),
+    CachedVabamorfAnalyzer(guess=False, propername=False, compound=False),
+])
+def test_normalizer_uses_the_pipeline_analyzer(vm_analyzer):
+    pipeline = MorphPipeline({'normalize': True, 'vm_analyzer': vm_analyzer, 'tokens_tagger': TokensTagger()})
+    assert pipeline.conf['normalizer'].vm_analyzer is vm_analyzer
+    # The normalized form is analysed without the compound word boundaries, like the rest of the text
+    text = pipeline.process(Text('rauddteejaam'))
+    assert [(a['normalized_text'], a['root']) for a in text.morph_analysis[0].annotations] == [('raudteejaam', 'raudteejaam')]
@@ -0,0 +1,92 @@
+import multiprocessing
+import os
+
+import morph_pipeline
+from morph_pipeline import build_user_dict_index, open_user_dict_index
+
+dictionaries = {
+    'global': 'text\troot\tending\tclitic\tpartofspeech\tform\nkohtomees\tkohtu_mees\t0\t\tS\tsg n\n',
+    'aru': 'text\troot\tending\tclitic\tpartofspeech\tform\nAleskei\tAleskei\t0\t\tH\tsg n\n',
+}
+
+# The logs of the compiled dictionaries and of the opened indexes, the workers write into them too
+compile_log = None
+open_log = None
+worker_index = None
+
+
+def write_dictionaries(user_dict_dir):
+    user_dict_dir.mkdir()
+    for location, data in dictionaries.items():
+        (user_dict_dir / (location+'.tsv')).write_text(data, encoding='utf-8')
+    return str(user_dict_dir)
+
+
+def logged_compile_user_dict(compile_user_dict):
+    def compile_and_log(dict_file):
+        with open(compile_log, 'a', encoding='utf-8') as fout:
+            fout.write(os.path.basename(dict_file)+'\n')
+        return compile_user_dict(dict_file)
+    return compile_and_log
+
+
+def init_worker(index_file):
+    global worker_index
+    worker_index = open_user_dict_index(index_file)
+    with open(open_log, 'a', encoding='utf-8') as fout:
+        fout.write('{}\t{}\n'.format(os.getpid(), os.stat(worker_index.index_file).st_ino))
+
+
+def lookup(word):
+    entry = worker_index.lookup('aru', word)
+    return entry['analysis'][0]['root'] if entry is not None else None
+
+
+def read_lines(path):
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding='utf-8') as fin:
+        return fin.read().splitlines()
+
+
+def test_stale_index_is_compiled_once(tmp_path, monkeypatch):
+    global compile_log, open_log
+    compile_log = str(tmp_path / 'compiled.log')
+    open_log = str(tmp_path / 'opened.log')
+    user_dict_dir = write_dictionaries(tmp_path / 'dicts')
+    build_user_dict_index(user_dict_dir)
+    # The dictionary of aru changes, so the index is stale
+    with open(os.path.join(user_dict_dir, 'aru.tsv'), 'a', encoding='utf-8') as fout:
+        fout.write('Reinomäggile\tReinomäggi\tle\t\tH\tsg all\n')
+    monkeypatch.setattr(morph_pipeline, 'compile_user_dict', logged_compile_user_dict(morph_pipeline.compile_user_dict))
+    index_file = build_user_dict_index(user_dict_dir)
+    pool = multiprocessing.get_context('fork').Pool(2, initializer=init_worker, initargs=(index_file,))
+    try:
+        roots = pool.map(lookup, ['Aleskei', 'Reinomäggile', 'Jaan']*4, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+    assert roots == ['Aleskei', 'Reinomäggi', None]*4
+    assert read_lines(compile_log) == ['aru.tsv']
+    # Both workers opened the same index file that the parent built
+    opened = [line.split('\t') for line in read_lines(open_log)]
+    assert len(opened) == 2
+    assert {inode for pid, inode in opened} == {str(os.stat(index_file).st_ino)}
+    assert [name for name in os.listdir(user_dict_dir) if name.endswith('.tmp')] == []
+
+
+def test_up_to_date_index_is_not_compiled(tmp_path, monkeypatch):
+    global compile_log
+    compile_log = str(tmp_path / 'compiled.log')
+    user_dict_dir = write_dictionaries(tmp_path / 'dicts')
+    index_file = build_user_dict_index(user_dict_dir)
+    monkeypatch.setattr(morph_pipeline, 'compile_user_dict', logged_compile_user_dict(morph_pipeline.compile_user_dict))
+    assert build_user_dict_index(user_dict_dir) == index_file
+    assert read_lines(compile_log) == []
+    index = open_user_dict_index(index_file)
+    assert sorted(index.sections) == ['aru', 'global']
+
+
+def test_no_user_dictionaries():
+    assert build_user_dict_index('') is None
+    assert open_user_dict_index(None) is None
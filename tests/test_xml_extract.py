@@ -0,0 +1,61 @@
+import codecs
+
+import pytest
+from bs4 import BeautifulSoup
+
+from corpus_readers import extract_xml_record
+
+
+def beautifulsoup_extract(data):
+    # The extraction as read_from_xml did it with BeautifulSoup, the file was read as utf-8 text
+    soup = BeautifulSoup(data.decode('utf-8'), "lxml")
+    content = soup.find("sisu").getText()
+    location = soup.find("vald").getText().lower()
+    try:
+        date = soup.find("aeg").getText()
+        year = date.split(".")[-1]
+    except AttributeError:
+        year = "n.a."
+    return (content, location, year)
+
+
+def record(sisu, vald='Kokora', aeg='<aeg>12.03.1870</aeg>', declaration=True):
+    text = '<dokument><vald>{}</vald>{}<sisu>{}</sisu></dokument>\n'.format(vald, aeg, sisu)
+    if declaration:
+        text = '<?xml version="1.0" encoding="utf-8"?>\n'+text
+    return text.encode('utf-8')
+
+
+records = {
+    'plain': record('Tulli  ette\nJosep Kallaste.'),
+    'nested markup': record('Tulli <b>ette</b><br/>Josep <i>Kal<u>las</u>te</i><p>uus</p> lõpp'),
+    'nested sisu': record('kaks<sisu>sees</sisu>välja'),
+    'entities': record('Josep &amp; Kallaste&nbsp;x &lt;y&gt; &#245; &#x00FC;'),
+    'comments': record('üks<!-- kommentaar -->kaks<!---->kolm'),
+    'cdata': record('<![CDATA[a < b]]> ja <x>y<z>w</z></x>'),
+    'bom': codecs.BOM_UTF8+record('ükskakskolm'),
+    'bom without declaration': codecs.BOM_UTF8+record('ükskakskolm', declaration=False),
+    'script': record('üks<script>x=1</script>kaks<style>y{}</style>kolm'),
+    'script with markup': record('üks<script type="text/javascript">if (a < b) { c(); }</script>kaks'),
+    'template and ruby': record('a<template>T<b>u</b></template>b<ruby>k<rp>(</rp><rt>R<b>S</b></rt><rp>)</rp></ruby>c'),
+    'script in vald': record('tekst', vald='Ko<script>x</script>kora'),
+    'missing aeg': record('tekst', aeg=''),
+    'empty aeg': record('tekst', aeg='<aeg></aeg>'),
+    'aeg without dots': record('tekst', aeg='<aeg>1870</aeg>'),
+    'upper case tags': b'<Dokument><VALD>ARU</VALD><Sisu>Suur</Sisu><AEG>1.2.1880</AEG></Dokument>',
+    'whitespace': b'<dokument>\n  <vald> Kokora </vald>\n  <aeg>1870</aeg>\n  <sisu>\n\tEsimene rida\n\tteine <i>rida</i>\n</sisu>\n</dokument>',
+}
+
+
+@pytest.mark.parametrize('name', sorted(records))
+def test_same_as_beautifulsoup(name):
+    data = records[name]
+    assert extract_xml_record(data) == beautifulsoup_extract(data)
+
+
+def test_script_and_style_are_dropped():
+    assert extract_xml_record(records['script']) == ('ükskakskolm', 'kokora', '1870')
+
+
+def test_missing_aeg():
+    assert extract_xml_record(records['missing aeg'])[2] == 'n.a.'